@@ -0,0 +1,5 @@
+from .execution import offload
+from .memo import invalidate, memoize
+from .metrics import add_profiler
+
+__all__ = ["add_profiler", "invalidate", "memoize", "offload"]
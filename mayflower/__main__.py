@@ -1,6 +1,119 @@
+import argparse
 import asyncio
 
-from .interface import Interface
+from .execution import DEFAULT_POLICIES
+from .imports import load, preload
+from .interface import COMPRESS_THRESHOLD, SHM_THRESHOLD, Interface
+from .memo import memoize
+from .signature import SIGNATURE_MODES
+from .workers import Supervisor, Template
 
-interface = Interface()
-asyncio.run(interface.run())
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python -m mayflower",
+        description="Cross the Atlantic by running Python from JavaScript",
+        # options can also be read from a file, one per line: python -m mayflower @args
+        fromfile_prefix_chars="@",
+    )
+    parser.add_argument(
+        "--execution",
+        choices=DEFAULT_POLICIES,
+        default="thread",
+        help="where synchronous Python callables invoked from JS run by default (only "
+        "those that never call into JS can run inline)",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=None,
+        help="size of the thread / process pool used by the execution policy",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=64,
+        help="maximum number of requests run at once per connection",
+    )
+    parser.add_argument(
+        "--signatures",
+        choices=SIGNATURE_MODES,
+        default="bounded",
+        help="how much of each returned object's repr is sent along for logging",
+    )
+    parser.add_argument(
+        "--session-grace",
+        type=float,
+        default=30.0,
+        help="seconds a disconnected client has to reconnect and resume its session",
+    )
+    parser.add_argument(
+        "--preload",
+        nargs="+",
+        action="extend",
+        default=[],
+        metavar="MODULE",
+        help="modules to import before accepting connections, rather than on first use",
+    )
+    parser.add_argument(
+        "--memoize",
+        nargs="+",
+        action="extend",
+        default=[],
+        metavar="MODULE",
+        help="modules whose functions are pure, so repeated calls from JS are cached",
+    )
+    parser.add_argument(
+        "--compress-threshold",
+        type=int,
+        default=COMPRESS_THRESHOLD,
+        metavar="BYTES",
+        help="deflate text messages at least this big (by default, none are)",
+    )
+    parser.add_argument(
+        "--shm-threshold",
+        type=int,
+        default=SHM_THRESHOLD,
+        metavar="BYTES",
+        help="hand messages at least this big to local clients through shared memory",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="serve Prometheus metrics on this port (plus the index of each worker)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of server processes to spread connections across (or, with "
+        "--template, of forks kept waiting for one)",
+    )
+    parser.add_argument(
+        "--template",
+        action="store_true",
+        help="serve each connection from a fresh fork of the started server, so none "
+        "of them sees what another did",
+    )
+    args = parser.parse_args()
+
+    options = {
+        "max_concurrency": args.max_concurrency,
+        "execution": args.execution,
+        "max_workers": args.max_workers,
+        "signatures": args.signatures,
+        "session_grace": args.session_grace,
+        "metrics_port": args.metrics_port,
+        "compress_threshold": args.compress_threshold,
+        "shm_threshold": args.shm_threshold,
+    }
+    # workers (and forks of the template) start with these already imported
+    preload(args.preload)
+    for name in args.memoize:
+        memoize(load(name, "preload"))
+    if args.template:
+        Template(args.workers, **options).run()
+    elif args.workers > 1:
+        Supervisor(args.workers, **options).run()
+    else:
+        asyncio.run(Interface(**options).run())
@@ -1,19 +1,18 @@
 import asyncio
+import concurrent.futures
 
 
-# abandon hope all ye who enter, here there be demons
-def run_from_sync(coro):
-    loop = asyncio.get_running_loop()
-    current_task = asyncio.current_task(loop=loop)
+def on_loop(loop):
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
 
-    task = asyncio.create_task(coro)
-    asyncio.tasks._leave_task(loop, current_task)
 
-    while not task.done():
-        loop._run_once()
-        if loop._stopping:
-            break
-
-    res = task.result()
-    asyncio.tasks._enter_task(loop, current_task)
-    return res
+def wait_sync(fut, timeout=None):
+    """Blocks until a future resolves, or raises `TimeoutError` after `timeout` seconds."""
+    # before 3.11, the future doesn't raise the builtin on timeout
+    try:
+        return fut.result(timeout)
+    except concurrent.futures.TimeoutError as e:
+        raise TimeoutError from e
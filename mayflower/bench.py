@@ -0,0 +1,340 @@
+"""
+Measures the bridge's own overhead, by driving a server over a local websocket the
+same way the JS client does. Run it with `python -m mayflower.bench`; results are
+printed as JSON so runs can be compared between versions.
+
+Unless `--connect` is given, a server is started for the run (and stopped after).
+Anything after `--` is passed along to it, ie. `-- --execution inline`.
+"""
+
+import argparse
+import asyncio
+import itertools
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+from typing import TYPE_CHECKING
+
+import orjson
+import websockets
+
+from . import framing
+from .interface import HOST, PORT
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any, Awaitable, Callable
+
+    Op = Callable[[], Awaitable[Any]]
+
+URL = f"ws://{HOST}:{PORT}"
+# the server only accepts messages up to 1 MiB
+LARGE = 1 << 19
+
+
+class BenchError(Exception):
+    pass
+
+
+class Client:
+    """
+    A minimal JS side of the protocol: requests Python and waits for the answer by
+    request id, and answers Python's calls into JS (ie. callbacks) with a number.
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.ids = itertools.count(1)
+        self.waiting: dict[int, asyncio.Future] = {}
+        self.reader = asyncio.create_task(self._read())
+
+    @classmethod
+    async def connect(cls, url: str, connect_timeout: float = 10.0) -> "Client":
+        deadline = time.monotonic() + connect_timeout
+        while True:
+            try:
+                websocket = await websockets.connect(
+                    url, compression=None, max_size=None
+                )
+                return cls(websocket)
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+    async def _read(self):
+        try:
+            async for data in self.websocket:
+                if isinstance(data, bytes):
+                    messages = [framing.unpack(data)]
+                elif isinstance(messages := orjson.loads(data), dict):
+                    messages = [messages]
+                for j in messages:
+                    if j.get("c") == "jsi":
+                        await self._answer(j)
+                    elif j.get("key") != "pre" and (
+                        fut := self.waiting.pop(j["r"], None)
+                    ):
+                        fut.set_result(j)
+        finally:
+            for fut in self.waiting.values():
+                fut.cancel()
+            self.waiting.clear()
+
+    async def _answer(self, j: dict):
+        if j["action"] == "free":
+            return
+        val = 1 if j["action"] == "call" else None
+        await self.websocket.send(
+            orjson.dumps({"r": j["r"], "key": "num", "val": val}).decode()
+        )
+
+    def next_id(self) -> int:
+        return next(self.ids)
+
+    async def request(
+        self, action: str, ffid: "Any" = 0, key: "Any" = (), val: "Any" = ()
+    ) -> dict:
+        r = self.next_id()
+        fut = self.waiting[r] = asyncio.get_running_loop().create_future()
+        msg = {"r": r, "action": action, "ffid": ffid, "key": key, "val": val}
+        buffers = []
+        data = orjson.dumps(msg, default=lambda obj: framing.attach(obj, buffers))
+        await self.websocket.send(
+            framing.pack(data, buffers) if buffers else data.decode()
+        )
+
+        j = await fut
+        if j["key"] == "error":
+            raise BenchError(f"{action} {key} failed:\n{j['sig']}")
+        return j
+
+    async def call(self, ffid: int, key: list, *args: "Any") -> "Any":
+        return (await self.request("pcall", ffid, key, [list(args), {}]))["val"]
+
+    async def eval(self, source: str) -> "Any":
+        return await self.call(0, ["eval"], source)
+
+    async def close(self):
+        await self.websocket.close()
+        self.reader.cancel()
+
+
+# Every case sets up whatever it needs for `n` operations, and returns the operation to
+# time, which does a single round trip. Large payloads are slower by orders of
+# magnitude, so they run fewer times.
+CASES: "dict[str, tuple[Callable[[Client, int], Awaitable[Op]], float]]" = {}
+
+
+def case(name: str, scale: float = 1.0):
+    def register(setup):
+        CASES[name] = (setup, scale)
+        return setup
+
+    return register
+
+
+@case("get")
+async def get(client: Client, n: int) -> "Op":
+    os = await client.call(0, ["python"], "os")
+    return lambda: client.request("get", os, ["path", "sep"])
+
+
+@case("call")
+async def call(client: Client, n: int) -> "Op":
+    return lambda: client.call(0, ["repr"], 1)
+
+
+@case("setval")
+async def setval(client: Client, n: int) -> "Op":
+    ns = await client.eval("__import__('types').SimpleNamespace()")
+    return lambda: client.request("setval", ns, [], [["x", 1], {}])
+
+
+@case("value")
+async def value(client: Client, n: int) -> "Op":
+    items = await client.eval("list(range(100))")
+    return lambda: client.request("value", items, [], [])
+
+
+@case("free")
+async def free(client: Client, n: int) -> "Op":
+    # frees aren't answered, so each one is sent in a batch to know when it's done
+    ffids = [await client.eval("object()") for _ in range(n)]
+
+    async def op():
+        r = client.next_id()
+        ops = [{"r": r, "action": "free", "ffid": "", "key": "", "val": [ffids.pop()]}]
+        return await client.request("batch", "", "", ops)
+
+    return op
+
+
+@case("callback")
+async def callback(client: Client, n: int) -> "Op":
+    fn = await client.eval("lambda cb: cb(1)")
+    return lambda: client.call(fn, [], {"r": client.next_id(), "ffid": ""})
+
+
+@case("iterate")
+async def iterate(client: Client, n: int) -> "Op":
+    numbers = await client.eval("range(10 ** 12)")
+    it = await client.call(0, ["Iterate"], {"ffid": numbers})
+    return lambda: client.request("iterate", it, [], 64)
+
+
+@case("large_in", scale=0.05)
+async def large_in(client: Client, n: int) -> "Op":
+    fn, payload = await client.eval("len"), bytes(LARGE)
+    return lambda: client.call(fn, [], payload)
+
+
+@case("large_out", scale=0.05)
+async def large_out(client: Client, n: int) -> "Op":
+    fn = await client.eval(f"(lambda b: lambda: b)(bytes({LARGE}))")
+    return lambda: client.call(fn, [])
+
+
+@case("large_value", scale=0.05)
+async def large_value(client: Client, n: int) -> "Op":
+    items = await client.eval("list(range(100_000))")
+    return lambda: client.request("value", items, [], [])
+
+
+def percentile(samples: list[float], q: float) -> float:
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+async def measure(op: "Op", iterations: int, concurrency: int) -> dict:
+    # latency, one request at a time
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await op()
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+
+    # throughput, with `concurrency` requests in flight
+    remaining = iter(range(iterations))
+
+    async def worker():
+        for _ in remaining:
+            await op()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "iterations": iterations,
+        "latency_us": {
+            "mean": round(sum(samples) / len(samples), 2),
+            "p50": round(percentile(samples, 0.5), 2),
+            "p90": round(percentile(samples, 0.9), 2),
+            "p99": round(percentile(samples, 0.99), 2),
+            "max": round(samples[-1], 2),
+        },
+        "throughput": {
+            "concurrency": concurrency,
+            "ops_per_second": round(iterations / elapsed, 1),
+        },
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    client = await Client.connect(args.url)
+    results = {}
+    try:
+        for name in args.cases:
+            setup, scale = CASES[name]
+            iterations = max(10, int(args.iterations * scale))
+            warmup = max(1, int(args.warmup * scale))
+            # every iteration is run twice, once for latency and once for throughput
+            op = await setup(client, warmup + 2 * iterations)
+            for _ in range(warmup):
+                await op()
+            results[name] = await measure(op, iterations, args.concurrency)
+            print(f"{name}: {results[name]['latency_us']}", file=sys.stderr)
+    finally:
+        await client.close()
+    return results
+
+
+def version() -> str | None:
+    try:
+        return metadata.version("mayflower")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def main(argv: list[str]):
+    server_args = []
+    if "--" in argv:
+        argv, server_args = argv[: argv.index("--")], argv[argv.index("--") + 1 :]
+
+    parser = argparse.ArgumentParser(
+        prog="python -m mayflower.bench",
+        description="Benchmarks the bridge over a local websocket",
+    )
+    parser.add_argument(
+        "--connect",
+        action="store_true",
+        help="use the server that's already running, rather than starting one",
+    )
+    parser.add_argument("--url", default=URL, help="where the server is listening")
+    parser.add_argument(
+        "--iterations", type=int, default=2000, help="requests timed per case"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=100, help="requests made before timing a case"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="requests in flight when measuring throughput",
+    )
+    parser.add_argument(
+        "--cases",
+        nargs="+",
+        choices=list(CASES),
+        default=list(CASES),
+        metavar="CASE",
+        help=f"which cases to run, out of {', '.join(CASES)}",
+    )
+    parser.add_argument("--output", help="write the results here rather than stdout")
+    args = parser.parse_args(argv)
+
+    server = None
+    if not args.connect:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "mayflower", *server_args],
+            stdout=subprocess.DEVNULL,
+        )
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "mayflower": version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "server_args": server_args,
+        "results": results,
+    }
+    data = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(data + b"\n")
+    else:
+        print(data.decode())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
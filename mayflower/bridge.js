@@ -1,12 +1,16 @@
 import { REQ_TIMEOUT, DEBUG } from "./env.js";
+import { attach, isBuffer, pack } from "./framing.js";
 import { JSBridge } from "./jsi.js";
 
 const logDebug = DEBUG ? console.debug : (..._) => {};
 
+// how many items of an async iterable Python may push ahead of us consuming them
+const STREAM_WINDOW = 64;
+
 class BridgeException extends Error {
-  constructor(...a) {
-    super(...a);
-    this.message += ` Python didn't respond in time (${REQ_TIMEOUT}ms), look above for any Python errors. If no errors, the API call hung.`;
+  constructor(message, timeout = REQ_TIMEOUT) {
+    super(message);
+    this.message += ` Python didn't respond in time (${timeout}ms), look above for any Python errors. If no errors, the API call hung.`;
     // We'll fix the stack trace once this is shipped.
   }
 }
@@ -152,6 +156,64 @@ async function waitFor(cb, withTimeout, onTimeout) {
 let nextReqId = 10000;
 const nextReq = () => nextReqId++;
 
+/**
+ * Collects bridge operations to send to Python in one round trip (see
+ * `Bridge.batch`). Each method returns a reference to its eventual result,
+ * which can be used as the target or an argument of any later operation in
+ * the same batch, eg.
+ *
+ *   const b = new Batch();
+ *   const os = b.call(0, ["python"], ["os"]);
+ *   b.call(os, ["path", "join"], ["a", "b"]);
+ *   const [, joined] = await bridge.batch(b);
+ */
+export class Batch {
+  ops = [];
+  stacks = [];
+
+  #push(action, target, stack, val) {
+    this.ops.push({
+      r: nextReq(),
+      action,
+      ffid: target?.$ref !== undefined ? target : (target?.ffid ?? target),
+      key: stack,
+      val,
+    });
+    this.stacks.push(stack);
+    return Object.freeze({ $ref: this.ops.length - 1 });
+  }
+
+  // references can't be told apart from plain objects once they're in Python,
+  // so as arguments they're sent the same way any other Python object is
+  #args(args) {
+    return args.map((a) => (a?.$ref !== undefined ? { ffid: a } : a));
+  }
+
+  get(target, stack) {
+    return this.#push("get", target, stack, []);
+  }
+
+  call(target, stack, args = [], kwargs = {}) {
+    return this.#push("pcall", target, stack, [this.#args(args), kwargs]);
+  }
+
+  set(target, stack, prop, val) {
+    return this.#push("setval", target, stack, [this.#args([prop, val]), {}]);
+  }
+
+  value(target, stack) {
+    return this.#push("value", target, stack, "");
+  }
+
+  length(target, stack) {
+    return this.#push("length", target, stack, "");
+  }
+
+  free(ffids) {
+    return this.#push("free", "", "", ffids);
+  }
+}
+
 export class Bridge {
   constructor(com) {
     this.com = com;
@@ -162,9 +224,12 @@ export class Bridge {
     // to Python
     this.freeable = [];
     this.loop = setInterval(this.runTasks, 1000);
+    // Bumped on reset, after which Python no longer has anything we held before
+    this.generation = 0;
 
     // This is called on GC
-    this.finalizer = new FinalizationRegistry((ffid) => {
+    this.finalizer = new FinalizationRegistry(([ffid, generation]) => {
+      if (generation !== this.generation) return;
       this.freeable.push(ffid);
       // Once the Proxy is freed, we also want to release the pyClass ref
       try {
@@ -180,6 +245,11 @@ export class Bridge {
       makePyObject: (ffid) => this.makePyObject(ffid),
     };
     this.com.register("jsi", this.jsi.onMessage.bind(this.jsi));
+
+    // Items of async iterables Python is streaming to us, by the request that opened
+    // the stream
+    this.streams = {};
+    this.com.register("stream", (msg) => this.streams[msg.s]?.(msg));
   }
 
   runTasks = () => {
@@ -191,6 +261,12 @@ export class Bridge {
     clearInterval(this.loop);
   }
 
+  reset() {
+    this.generation++;
+    this.freeable = [];
+    this.jsi.reset();
+  }
+
   request(req, cb) {
     // When we call Python functions with Proxy paramaters, we need to just send the FFID
     // so it can be mapped on the python side.
@@ -209,6 +285,7 @@ export class Bridge {
       (cb) => this.request(req, cb),
       REQ_TIMEOUT,
       () => {
+        this.cancel(req.r);
         throw new BridgeException(
           `Attempt to access '${stack.join(".")}' failed.`,
         );
@@ -218,6 +295,122 @@ export class Bridge {
     return resp.val;
   }
 
+  // Pulls up to `n` items out of a Python `Iterate`, resolving with them and
+  // whether it's exhausted
+  async iterate(ffid, n) {
+    const req = { r: nextReq(), action: "iterate", ffid, key: [], val: n };
+    const resp = await waitFor(
+      (cb) => this.request(req, cb),
+      REQ_TIMEOUT,
+      () => {
+        this.cancel(req.r);
+        throw new BridgeException("Attempt to iterate failed.");
+      },
+    );
+    if (resp.key === "error") throw new PythonException([], resp.sig);
+    const { items, done } = resp.val;
+    return [
+      items.map(([key, val, sig]) => this.unwrap({ key, val, sig })),
+      done,
+    ];
+  }
+
+  // Iterates a Python object. Async iterables are streamed: Python pushes items as
+  // they're produced, for as long as we've given it credit to. Anything else is
+  // pulled in chunks, which grow while Python keeps up and shrink when it's slow.
+  async *iterator(ffid) {
+    const r = nextReq();
+    const items = [];
+    let done = false;
+    let error = null;
+    let wake = () => {};
+    this.streams[r] = (msg) => {
+      if (msg.item) {
+        const [key, val, sig] = msg.item;
+        items.push(this.unwrap({ key, val, sig }));
+      } else {
+        error = msg.error;
+        done = true;
+      }
+      wake();
+    };
+
+    const req = { r, action: "stream", ffid, key: [], val: STREAM_WINDOW };
+    const resp = await waitFor(
+      (cb) => this.request(req, cb),
+      REQ_TIMEOUT,
+      () => {
+        this.cancel(req.r);
+        throw new BridgeException("Attempt to iterate failed.");
+      },
+    );
+    if (resp.key !== "stream") {
+      delete this.streams[r];
+      if (resp.key === "error") throw new PythonException([], resp.sig);
+      for (let n = 8; ; ) {
+        const start = performance.now();
+        const [chunk, end] = await this.iterate(resp.val, n);
+        const took = performance.now() - start;
+        yield* chunk;
+        if (end) return;
+        if (took < 50) n = Math.min(n * 2, 1024);
+        else if (took > 200) n = Math.max(n >> 1, 1);
+      }
+    }
+
+    let consumed = 0;
+    try {
+      while (true) {
+        while (items.length) {
+          yield items.shift();
+          // credit is handed back in bulk, rather than an item at a time
+          if (++consumed >= STREAM_WINDOW / 2) {
+            this.credit(r, consumed);
+            consumed = 0;
+          }
+        }
+        if (error) throw new PythonException([], error);
+        if (done) return;
+        await new Promise((resolve) => (wake = resolve));
+      }
+    } finally {
+      delete this.streams[r];
+      // we stopped early, so Python can stop producing too
+      if (!done) {
+        this.request({
+          r: nextReq(),
+          action: "aclose",
+          ffid: "",
+          key: "",
+          val: r,
+        });
+      }
+    }
+  }
+
+  // Has Python stop working on a request we gave up on, which also releases whatever
+  // it allocated for us. If the answer was already on its way, we free it ourselves.
+  cancel(r) {
+    this.com.register(r, (resp) => {
+      if (resp.key === "pre") return true;
+      if (["class", "fn", "obj", "list", "inst"].includes(resp.key)) {
+        this.freeable.push(...[resp.val].flat());
+      }
+    });
+    this.request({ r: nextReq(), action: "cancel", ffid: "", key: "", val: r });
+  }
+
+  credit(stream, n) {
+    const req = {
+      r: nextReq(),
+      action: "credit",
+      ffid: "",
+      key: "",
+      val: [stream, n],
+    };
+    this.request(req);
+  }
+
   async get(ffid, stack, args, suppressErrors) {
     const req = {
       r: nextReq(),
@@ -231,6 +424,7 @@ export class Bridge {
       (cb) => this.request(req, cb),
       REQ_TIMEOUT,
       () => {
+        this.cancel(req.r);
         throw new BridgeException(
           `Attempt to access '${stack.join(".")}' failed.`,
         );
@@ -240,16 +434,7 @@ export class Bridge {
       if (suppressErrors) return undefined;
       throw new PythonException(stack, resp.sig);
     }
-    switch (resp.key) {
-      case "string":
-      case "int":
-        return resp.val; // Primitives don't need wrapping
-      default: {
-        const py = this.makePyObject(resp.val, resp.sig);
-        this.queueForCollection(resp.val, py);
-        return py;
-      }
-    }
+    return this.unwrap(resp);
   }
 
   async call(ffid, stack, args, kwargs, set, timeout) {
@@ -262,12 +447,49 @@ export class Bridge {
       key: stack,
       val: [args, kwargs],
     };
-    // The following serializes our arguments and sends them to Python.
-    // When we provide FFID as '', we ask Python to assign a new FFID on
-    // its side for the purpose of this function call, then to return
-    // the number back to us
-    const payload = JSON.stringify(req, (k, v) => {
+    // Python gives up at the same time we do
+    if (timeout) req.d = timeout;
+    const payload = this.serialize(req, made);
+
+    const resp = await waitFor(
+      (resolve) =>
+        this.com.writeRaw(payload, r, (pre) => {
+          if (pre.key === "pre") {
+            this.adopt(pre, made, stack);
+            return true;
+          } else {
+            resolve(pre);
+          }
+        }),
+      timeout || REQ_TIMEOUT,
+      () => {
+        this.cancel(req.r);
+        throw new BridgeException(
+          `Attempt to access '${stack.join(".")}' failed.`,
+          timeout,
+        );
+      },
+    );
+    if (resp.key === "error") throw new PythonException(stack, resp.sig);
+
+    if (set) {
+      return true; // Do not allocate new FFID if setting
+    }
+
+    logDebug("call", ffid, stack, args, resp);
+    return this.unwrap(resp);
+  }
+
+  // The following serializes our arguments so they can be sent to Python.
+  // When we provide FFID as '', we ask Python to assign a new FFID on
+  // its side for the purpose of this function call, then to return
+  // the number back to us
+  // Buffers and typed arrays are sent as binary attachments rather than JSON.
+  serialize(req, made) {
+    const buffers = [];
+    const json = JSON.stringify(req, (k, v) => {
       if (!k) return v;
+      if (isBuffer(v)) return attach(v, buffers);
       if (v && !v.r) {
         if (v instanceof PyClass) {
           const r = nextReq();
@@ -288,46 +510,32 @@ export class Bridge {
       }
       return v;
     });
+    return buffers.length ? pack(json, buffers) : json;
+  }
 
-    const resp = await waitFor(
-      (resolve) =>
-        this.com.writeRaw(payload, r, (pre) => {
-          if (pre.key === "pre") {
-            for (const r in pre.val) {
-              const ffid = pre.val[r];
-              // Python is the owner of the memory, we borrow a ref to it and once
-              // we're done with it (GC'd), we can ask python to free it
-              if (made[r] instanceof Promise)
-                throw Error(
-                  "You did not await a parameter when calling " +
-                    stack.join("."),
-                );
-              this.jsi.m[ffid] = made[r];
-              this.queueForCollection(ffid, made[r]);
-            }
-            return true;
-          } else {
-            resolve(pre);
-          }
-        }),
-      timeout || REQ_TIMEOUT,
-      () => {
-        throw new BridgeException(
-          `Attempt to access '${stack.join(".")}' failed.`,
+  // Takes ownership of the FFIDs Python assigned to our arguments
+  adopt(pre, made, stack) {
+    for (const r in pre.val) {
+      const ffid = pre.val[r];
+      // Python is the owner of the memory, we borrow a ref to it and once
+      // we're done with it (GC'd), we can ask python to free it
+      if (made[r] instanceof Promise)
+        throw Error(
+          "You did not await a parameter when calling " + stack.join("."),
         );
-      },
-    );
-    if (resp.key === "error") throw new PythonException(stack, resp.sig);
-
-    if (set) {
-      return true; // Do not allocate new FFID if setting
+      this.jsi.m[ffid] = made[r];
+      this.queueForCollection(ffid, made[r]);
     }
+  }
 
-    logDebug("call", ffid, stack, args, resp);
+  unwrap(resp) {
     switch (resp.key) {
       case "string":
       case "int":
+      case "bytes":
         return resp.val; // Primitives don't need wrapping
+      case "void":
+        return undefined;
       default: {
         const py = this.makePyObject(resp.val, resp.sig);
         this.queueForCollection(resp.val, py);
@@ -336,6 +544,53 @@ export class Bridge {
     }
   }
 
+  /**
+   * Sends every operation queued on a `Batch` to Python in a single frame, and
+   * resolves with each of their results in order. Python runs them one after
+   * the other and stops at the first error, which is thrown here.
+   */
+  async batch(batch, timeout) {
+    const made = {};
+    const r = nextReq();
+    const req = { r, action: "batch", ffid: "", key: "", val: batch.ops };
+    if (timeout) req.d = timeout;
+    const payload = this.serialize(req, made);
+
+    const resp = await waitFor(
+      (cb) => this.com.writeRaw(payload, r, cb),
+      timeout || REQ_TIMEOUT,
+      () => {
+        this.cancel(req.r);
+        throw new BridgeException(
+          `Attempt to run a batch of ${batch.ops.length} failed.`,
+          timeout,
+        );
+      },
+    );
+
+    const responses = {};
+    for (const msg of resp.val) {
+      if (msg.key === "pre") this.adopt(msg, made, []);
+      else responses[msg.r] = msg;
+    }
+    return batch.ops.map((op, i) => {
+      const resp = responses[op.r];
+      if (resp?.key === "error")
+        throw new PythonException(batch.stacks[i], resp.sig);
+      if (!resp) return undefined; // either didn't respond (free) or never ran
+      switch (op.action) {
+        case "setval":
+          return true;
+        case "value":
+        case "length":
+        case "inspect":
+          return resp.val;
+        default:
+          return this.unwrap(resp);
+      }
+    });
+  }
+
   async value(ffid, stack) {
     const req = {
       r: nextReq(),
@@ -348,6 +603,7 @@ export class Bridge {
       (cb) => this.request(req, cb),
       REQ_TIMEOUT,
       () => {
+        this.cancel(req.r);
         throw new BridgeException(
           `Attempt to access '${stack.join(".")}' failed.`,
         );
@@ -357,6 +613,21 @@ export class Bridge {
     return resp.val;
   }
 
+  // Python's metrics, see `metrics.py`
+  async stats() {
+    const req = { r: nextReq(), action: "stats", ffid: "", key: "", val: "" };
+    const resp = await waitFor(
+      (cb) => this.request(req, cb),
+      REQ_TIMEOUT,
+      () => {
+        this.cancel(req.r);
+        throw new BridgeException("Attempt to get stats failed.");
+      },
+    );
+    if (resp.key === "error") throw new PythonException([], resp.sig);
+    return resp.val;
+  }
+
   async inspect(ffid, stack) {
     const req = {
       r: nextReq(),
@@ -369,6 +640,7 @@ export class Bridge {
       (cb) => this.request(req, cb),
       REQ_TIMEOUT,
       () => {
+        this.cancel(req.r);
         throw new BridgeException(
           `Attempt to access '${stack.join(".")}' failed.`,
         );
@@ -385,7 +657,7 @@ export class Bridge {
   }
 
   queueForCollection(ffid, val) {
-    this.finalizer.register(val, ffid);
+    this.finalizer.register(val, [ffid, this.generation]);
   }
 
   /**
@@ -405,6 +677,7 @@ export class Bridge {
       (cb) => this.request(req, cb),
       500,
       () => {
+        this.cancel(req.r);
         throw new BridgeException(`Attempt to create '${name}' failed.`);
       },
     );
@@ -476,17 +749,7 @@ export class Bridge {
             };
           }
           if (prop === Symbol.asyncIterator) {
-            return async function* iter() {
-              const it = await self.call(0, ["Iterate"], [{ ffid }]);
-              while (true) {
-                const val = await it.Next();
-                if (val === "$$STOPITER") {
-                  return;
-                } else {
-                  yield val;
-                }
-              }
-            };
+            return () => this.iterator(ffid);
           }
           logDebug("Get symbol", next.callstack, prop);
           return;
@@ -1,30 +1,55 @@
-import importlib
-import importlib.util
+import asyncio
+import functools
 import inspect
+import time
 import traceback
-from weakref import WeakValueDictionary
-
+from contextvars import ContextVar
+
+from .dispatch import Dispatcher, current_allocations
+from .execution import ExecutionPool
+from .handles import HandleTable
+from .imports import load, times
+from .memo import MISSING, invalidate, memo_for, memoize
+from .memo import stats as memo_stats
+from .metrics import metrics
 from .proxy import Executor, Proxy
+from .resolve import PathCache
+from .signature import SIGNATURE_MODES, make_signature
+from .stream import Stream
 
 
 def python(method):
-    return importlib.import_module(method, package=None)
+    return load(method)
+
+
+# `py` code from JS runs against this module's globals when it isn't given any, since
+# they default to those of whatever frame calls eval (ie. the thread pool's)
+def evaluate(source, globals=None, locals=None):
+    return eval(source, globals, locals)
+
+
+def execute(source, globals=None, locals=None):
+    exec(source, globals, locals)
 
 
 class Iterate:
     def __init__(self, v):
         self.what = v
+        # raised on the next take(), when it interrupted one that already had items
+        self.error = None
 
         # If we have a normal iterator, we need to make it a generator
         if inspect.isgeneratorfunction(v):
-            it = self.next_gen()
+            self.it = self.next_gen()
         elif hasattr(v, "__iter__"):
-            it = self.next_iter()
+            self.it = self.next_iter()
+        else:
+            raise TypeError(f"{v!r} is not iterable")
 
         def next_iter():
             try:
-                return next(it)
-            except Exception:
+                return next(self.it)
+            except StopIteration:
                 return "$$STOPITER"
 
         self.Next = next_iter
@@ -37,169 +62,219 @@ class Iterate:
     def next_gen(self):
         yield self.what()
 
+    def take(self, n):
+        """Pulls up to `n` more items, returning them and whether we ran out."""
+        if (error := self.error) is not None:
+            self.error = None
+            raise error
 
-def fix_key(key):
-    return key.replace("~~", "") if isinstance(key, str) else key
+        items = []
+        try:
+            for _ in range(n):
+                items.append(next(self.it))
+        except StopIteration:
+            return items, True
+        except Exception as e:
+            if not items:
+                raise
+            self.error = e
+        return items, False
+
+
+class JSMember:
+    """
+    An attribute of a Python class extended from JS which JS overrides, so it's read
+    from the instance's JS side instead. Writes still land on the instance.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, inst, owner=None):
+        if inst is None:
+            return self
+        return getattr(inst.__dict__["~proxy"], self.name)
+
+    def __set__(self, inst, val):
+        inst.__dict__[self.name] = val
+
+
+# Classes extended from JS are shared between every instance with the same name,
+# bases and overrides. Only overridden attributes go through JS, anything else is
+# looked up natively.
+@functools.lru_cache(maxsize=256)
+def js_subclass(name, bases, overriden):
+    def getAttr(self, attr):
+        if attr.startswith("~~"):  # Bypass keyword for JS calling into the superclass
+            attr = attr[2:]
+            try:
+                return getattr(super(clas, self), attr)
+            except AttributeError:
+                if attr in self.__dict__:
+                    return self.__dict__[attr]
+                raise
+        if (fallback := getattr(super(clas, self), "__getattr__", None)) is not None:
+            return fallback(attr)
+        raise AttributeError(f"'{name}' object has no attribute '{attr}'")
+
+    def setAttr(self, attr, val):
+        # Trippy stuff, but we need to set on both super and this
+        # to avoid a mess
+        super(clas, self).__setattr__(attr, val)
+        object.__setattr__(self, attr, val)
+
+    namespace = {"__getattr__": getAttr, "__setattr__": setAttr}
+    for attr in overriden:
+        if not attr.startswith("__"):
+            namespace[attr] = JSMember(attr)
+    clas = type(name, bases, namespace)
+    return clas
+
+
+# what JS can ask of the bridge. requests for anything else fail, and are counted
+# together in the metrics rather than by whatever name they gave
+ACTIONS = frozenset(
+    (
+        "aclose",
+        "batch",
+        "credit",
+        "free",
+        "get",
+        "init",
+        "inspect",
+        "iterate",
+        "length",
+        "make",
+        "makeclass",
+        "pcall",
+        "Set",
+        "setval",
+        "stats",
+        "stream",
+        "value",
+    )
+)
+
+# while a batch is running, responses are collected here rather than sent
+current_batch: ContextVar[list | None] = ContextVar("current_batch", default=None)
+
+
+def resolve_refs(what, results):
+    """
+    Swaps out every `{"$ref": i}` in a batched operation with the result of the i-th
+    operation of the batch.
+    """
+    if isinstance(what, dict):
+        if len(what) == 1 and "$ref" in what:
+            return results[what["$ref"]]
+        return {k: resolve_refs(v, results) for k, v in what.items()}
+    if isinstance(what, list):
+        return [resolve_refs(v, results) for v in what]
+    return what
 
 
 class Bridge:
-    m = {
-        0: {
-            "python": python,
-            "open": open,
-            "eval": eval,
-            "exec": exec,
-            "setattr": setattr,
-            "getattr": getattr,
-            "Iterate": Iterate,
-            "tuple": tuple,
-            "set": set,
-            "enumerate": enumerate,
-            "repr": repr,
-        }
+    # what JS sees as ffid 0
+    namespace = {
+        "python": python,
+        "open": open,
+        "eval": evaluate,
+        "exec": execute,
+        "setattr": setattr,
+        "getattr": getattr,
+        "Iterate": Iterate,
+        "tuple": tuple,
+        "set": set,
+        "enumerate": enumerate,
+        "repr": repr,
     }
-    # Things added to this dict are auto GC'ed
-    weakmap = WeakValueDictionary()
-    cur_ffid = 0
 
-    def __init__(self, ipc):
+    def __init__(self, ipc, max_concurrency=64, pool=None, signatures="bounded"):
         self.ipc = ipc
-        # This toggles if we want to send inspect data for console logging. It's auto
-        # disabled when a for loop is active; use `repr` to request logging instead.
-        self.m[0]["sendInspect"] = lambda x: setattr(self, "send_inspect", x)
-        self.send_inspect = True
-        self.q = lambda r, key, val, sig="": self.ipc.queue(
-            {"r": r, "key": key, "val": val, "sig": sig}
+        self.loop = asyncio.get_running_loop()
+        # everything this connection has handed out to JS, released when it closes
+        self.m = HandleTable(dict(self.namespace))
+        # where synchronous callables run when invoked from JS
+        self.pool = pool or ExecutionPool()
+        # How much inspect data to send along with objects for console logging, see
+        # `signature.SIGNATURE_MODES`. Use `repr` to request the full thing instead.
+        self.m[0]["signatures"] = self.set_signatures
+        self.m[0]["sendInspect"] = lambda x: self.set_signatures(
+            "bounded" if x else "lazy"
         )
+        self.m[0]["handles"] = self.m.stats
+        self.m[0]["imports"] = times.stats
+        self.m[0]["memoize"] = memoize
+        self.m[0]["memos"] = memo_stats
+        self.m[0]["invalidate"] = invalidate
+        self.set_signatures(signatures)
+        # the bridge's own callables, whose effects have to happen in this process
+        self.internals = tuple(self.m[0].values())
         self.executor = Executor(self)
+        self.dispatcher = Dispatcher(self, max_concurrency)
+        # compiled attribute paths, so hot paths don't probe the same keys every time
+        self.paths = PathCache()
+        # async iterables being streamed to JS, by the request that opened them
+        self.streams: dict[int, Stream] = {}
+        metrics.track(self)
 
         # os.JSPyBridge = Proxy(self.executor, 0)
 
+    def resolve(self, ffid, keys, invoke=False):
+        return self.paths.resolve(self.m[ffid], ffid, keys, invoke)
+
     def assign_ffid(self, what):
-        self.cur_ffid += 1
-        self.m[self.cur_ffid] = what
-        return self.cur_ffid
-
-    def make_class(this, name, proxy, bases, overriden):
-        def init(self):
-            for base_ffid, baseArgs, baseKwargs in bases:
-                base = this.m[base_ffid]
-                base.__init__(self, *baseArgs, **baseKwargs)
-
-        def getAttribute(self, attr):
-            if attr.startswith("__"):
-                return object.__getattribute__(self, attr)
-            if attr.startswith("~~"):  # Bypass keyword for our __getattribute__ trap
-                return super(clas, self).__getattribute__(attr[2:])
-            if attr in overriden:
-                return getattr(proxy, attr)
-            return super(clas, self).__getattribute__(attr)
-
-        def setAttr(self, attr, val):
-            # Trippy stuff, but we need to set on both super and this
-            # to avoid a mess
-            super(clas, self).__setattr__(attr, val)
-            object.__setattr__(self, attr, val)
-
-        base_classes = []
-        for base_ffid, _, _ in bases:
-            base = this.m[base_ffid]
-            base_classes.append(base)
-
-        # claz = type(base_classes[0])
-        clas = type(
-            name,
-            tuple(base_classes),
-            {
-                "__init__": init,
-                "__getattribute__": getAttribute,
-                "__setattr__": setAttr,
-            },
-        )
-        inst = clas()
+        ffid = self.m.add(what)
+        if (allocated := current_allocations.get()) is not None:
+            allocated.append(ffid)
+        return ffid
+
+    def release(self, ffids):
+        for i in ffids:
+            if i not in self.m:
+                continue
+            del self.m[i]
+            self.paths.invalidate(i)
+
+    def make_class(self, name, proxy, bases, overriden):
+        base_classes = tuple(self.m[base_ffid] for base_ffid, _, _ in bases)
+        clas = js_subclass(name, base_classes, frozenset(overriden))
+        inst = clas.__new__(clas)
+        # set before any base initializer runs, since it may call overridden methods
+        object.__setattr__(inst, "~proxy", proxy)
+        for base_ffid, baseArgs, baseKwargs in bases:
+            self.m[base_ffid].__init__(inst, *baseArgs, **baseKwargs)
         setattr(proxy, "~class", inst)
         return inst
 
     # Here, we allocate two different refrences. The first is the Proxy to the JS
     # class, the send is a ref to our Python class. Both refs are GC tracked by JS.
     async def makeclass(self, r, ffid, key, params):
-        self.cur_ffid += 1
-        js_ffid = self.cur_ffid
+        js_ffid = self.m.reserve()
         proxy = Proxy(self.executor, js_ffid)
-        self.m[js_ffid] = proxy
-        inst = self.make_class(
-            params["name"], proxy, params["bases"], params["overriden"]
-        )
+        self.m.bind(js_ffid, proxy)
+        # the base initializers may call overridden methods, which are in JS
+        args = [params["name"], proxy, params["bases"], params["overriden"]]
+        policy = self.pool.policy_for(self.make_class)
+        inst = await self.pool.run(self.make_class, args, {}, policy)
         py_ffid = self.assign_ffid(inst)
         await self.q(r, "inst", [js_ffid, py_ffid])
 
     async def length(self, r, ffid, keys, args):
-        v = self.m[ffid]
-        for key in keys:
-            if isinstance(v, (dict, tuple, list)):
-                v = v[key]
-            elif hasattr(v, str(key)):
-                v = getattr(v, str(key))
-            elif hasattr(v, "__getitem__"):
-                try:
-                    v = v[key]
-                except Exception as e:
-                    raise LookupError(
-                        f"Property '{fix_key(key)}' does not exist on {repr(v)}"
-                    ) from e
-            else:
-                raise LookupError(
-                    f"Property '{fix_key(key)}' does not exist on {repr(v)}"
-                )
+        v = self.resolve(ffid, keys)
         length = len(v)
         await self.q(r, "num", length)
 
     async def init(self, r, ffid, key, args):
-        v = self.m[ffid](*args)
+        clas = self.m[ffid]
+        v = await self.pool.run(clas, args, {}, self.pool.policy_for(clas))
         ffid = self.assign_ffid(v)
         await self.q(r, "inst", ffid)
 
     async def call(self, r, ffid, keys, args, kwargs, invoke=True):
-        v = self.m[ffid]
-        # Subtle differences here depending on if we want to call or get a property.
-        # Since in Python, items ([]) and attributes (.) function differently,
-        # when calling first we want to try . then []
-        # For example with the .append function we don't want ['append'] taking
-        # precedence in a dict. However if we're only getting objects, we can
-        # first try bracket for dicts, then attributes.
-        if invoke:
-            for key in keys:
-                t = getattr(v, str(key), None)
-                if t:
-                    v = t
-                elif hasattr(v, "__getitem__"):
-                    try:
-                        v = v[key]
-                    except Exception as e:
-                        raise LookupError(
-                            f"Property '{fix_key(key)}' does not exist on {repr(v)}"
-                        ) from e
-                else:
-                    raise LookupError(
-                        f"Property '{fix_key(key)}' does not exist on {repr(v)}"
-                    )
-        else:
-            for key in keys:
-                if isinstance(v, (dict, tuple, list)):
-                    v = v[key]
-                elif hasattr(v, str(key)):
-                    v = getattr(v, str(key))
-                elif hasattr(v, "__getitem__"):
-                    try:
-                        v = v[key]
-                    except Exception as e:
-                        raise LookupError(
-                            f"Property '{fix_key(key)}' does not exist on {repr(v)}"
-                        ) from e
-                else:
-                    raise LookupError(
-                        f"Property '{fix_key(key)}' does not exist on {repr(v)}"
-                    )
+        # Subtle differences here depending on if we want to call or get a property,
+        # see `resolve.walk`
+        v = self.resolve(ffid, keys, invoke)
 
         # Classes when called will return void, but we need to return
         # object to JS.
@@ -208,35 +283,52 @@ class Bridge:
             if inspect.isclass(v):
                 was_class = True
 
-            v = v(*args, **kwargs)
-            if inspect.isawaitable(v):
-                v = await v
-
+            policy = self.pool.policy_for(v, kwargs.pop("$policy", None))
+            if policy == "process" and any(v is f for f in self.internals):
+                policy = "thread"
+            # pure callables JS already called with the same arguments aren't run again
+            memo = key = None
+            if not was_class and (memo := memo_for(v)) is not None:
+                key = memo.key(v, args, kwargs)
+            if key is not None and (cached := memo.get(key)) is not MISSING:
+                v = cached
+            else:
+                fn = v
+                with metrics.profile(fn):
+                    v = await self.pool.run(fn, args, kwargs, policy)
+                    if inspect.isawaitable(v):
+                        v = await v
+                if key is not None:
+                    memo.put(key, v)
+
+        await self.q(r, *self.describe(v, was_class))
+
+    def describe(self, v, was_class=False):
+        """
+        Returns how a value is sent to JS as `(key, val, sig)`: primitives by value,
+        everything else by reference.
+        """
         if isinstance(v, str):
-            await self.q(r, "string", v)
-            return
+            return "string", v, ""
         if isinstance(v, (int, float)) or (v is None) or (v is True) or (v is False):
-            await self.q(r, "int", v)
-            return
+            return "int", v, ""
+        if isinstance(v, (bytes, bytearray, memoryview)):
+            # sent as a binary attachment, JS gets it as a typed array
+            return "bytes", v, ""
         if inspect.isclass(v) or isinstance(v, type):
             # We need to increment FFID
-            await self.q(r, "class", self.assign_ffid(v), self.make_signature(v))
-            return
+            return "class", self.assign_ffid(v), self.make_signature(v)
         if callable(v):  # anything with __call__
-            await self.q(r, "fn", self.assign_ffid(v), self.make_signature(v))
-            return
+            return "fn", self.assign_ffid(v), self.make_signature(v)
         if (
             isinstance(v, dict) or (inspect.ismodule(v)) or was_class
         ):  # "object" in JS speak
-            await self.q(r, "obj", self.assign_ffid(v), self.make_signature(v))
-            return
+            return "obj", self.assign_ffid(v), self.make_signature(v)
         if isinstance(v, list):
-            await self.q(r, "list", self.assign_ffid(v), self.make_signature(v))
-            return
+            return "list", self.assign_ffid(v), self.make_signature(v)
         if hasattr(v, "__class__"):  # numpy generator can't be picked up without this
-            await self.q(r, "class", self.assign_ffid(v), self.make_signature(v))
-            return
-        await self.q(r, "void", self.cur_ffid)
+            return "class", self.assign_ffid(v), self.make_signature(v)
+        return "void", None, ""
 
     # Same as call just without invoking anything, and args
     # would be null
@@ -244,72 +336,113 @@ class Bridge:
         o = await self.call(r, ffid, keys, [], {}, invoke=False)
         return o
 
+    # Pulls the next chunk of items out of an `Iterate`, each one described the same
+    # way `call` would describe it
+    async def iterate(self, r, ffid, keys, n):
+        it = self.resolve(ffid, keys)
+        items, done = await self.pool.run(
+            it.take, [n], {}, self.pool.policy_for(it.take)
+        )
+        val = {"items": [self.describe(v) for v in items], "done": done}
+        await self.q(r, "items", val)
+
+    # Async iterables are pushed to JS as they produce items, up to `window` items
+    # ahead of what JS has consumed. Anything else is iterated in chunks instead, for
+    # which JS gets an `Iterate` to pull from.
+    async def stream(self, r, ffid, keys, window):
+        v = self.resolve(ffid, keys)
+        if not hasattr(v, "__aiter__"):
+            await self.q(r, "iterate", self.assign_ffid(Iterate(v)))
+            return
+
+        stream = self.streams[r] = Stream(self, r, aiter(v), window)
+        await self.q(r, "stream", None)
+        stream.start()
+
+    # no ACK needed
+    def credit(self, r, ffid, key, args):
+        sid, n = args
+        if (stream := self.streams.get(sid)) is not None:
+            stream.grant(n)
+
+    # no ACK needed, JS stopped listening
+    async def aclose(self, r, ffid, key, sid):
+        if (stream := self.streams.pop(sid, None)) is not None:
+            await stream.close()
+
     async def Set(self, r, ffid, keys, args):
-        v = self.m[ffid]
+        v = self.resolve(ffid, keys)
         on, val = args
-        for key in keys:
-            if isinstance(v, (dict, tuple, list)):
-                v = v[key]
-            elif hasattr(v, str(key)):
-                v = getattr(v, str(key))
-            else:
-                try:
-                    v = v[key]
-                except Exception as e:
-                    raise LookupError(
-                        f"Property '{fix_key(key)}' does not exist on {repr(v)}"
-                    ) from e
 
         if isinstance(v, (dict, tuple, list, set)):
             v[on] = val
         else:
             setattr(v, on, val)
-        await self.q(r, "void", self.cur_ffid)
+        # the shape of the object may have changed, so re-resolve paths through it
+        self.paths.invalidate(ffid)
+        await self.q(r, "void", None)
 
     async def inspect(self, r, ffid, keys, args):
-        v = self.m[ffid]
-        for key in keys:
-            v = getattr(v, key, None) or v[key]
+        v = self.resolve(ffid, keys)
         s = repr(v)
         await self.q(r, "", s)
 
     # no ACK needed
     def free(self, r, ffid, key, args):
-        for i in args:
-            if i not in self.m:
-                continue
-            del self.m[i]
+        metrics.frees_in += len(args)
+        self.release(args)
+
+    # reserved for instrumentation: the process' metrics, plus this connection's
+    async def stats(self, r, ffid, key, args):
+        stats = metrics.snapshot()
+        stats["connection"] = {
+            "pending_requests": len(self.dispatcher.tasks),
+            "pending_js_calls": len(self.executor.pending),
+            "outbound": self.ipc.stats(),
+            "handles": self.m.stats(),
+        }
+        await self.q(r, "ser", stats)
 
     async def make(self, r, ffid, key, args):
-        self.cur_ffid += 1
-        p = Proxy(self.executor, self.cur_ffid)
-        # We need to put into both WeakMap and map to prevent immedate GC
-        self.weakmap[self.cur_ffid] = p
-        self.m[self.cur_ffid] = p
-        await self.ipc.queue({"r": r, "val": self.cur_ffid})
+        ffid = self.m.reserve()
+        self.m.bind(ffid, Proxy(self.executor, ffid))
+        await self.q(r, "", ffid)
+
+    async def q(self, r, key, val, sig=""):
+        msg = {"r": r, "key": key, "val": val, "sig": sig}
+        if (batch := current_batch.get()) is not None:
+            batch.append(msg)
+            return
+        await self.ipc.queue(msg)
 
     async def queue_request(self, request_id, payload, timeout=None):
         payload["c"] = "jsi"
         await self.ipc.queue(payload)
 
     async def queue_request_raw(self, request_id, payload, timeout=None):
-        await self.ipc.queue(payload)
-
-    def make_signature(self, what):
-        if self.send_inspect:
-            return repr(what)
-        return ""
+        await self.ipc.send(payload)
 
-    async def read(self):
-        data = await self.ipc.websocket.recv()
-        if not data:
-            pass  # exit()
+    def set_signatures(self, mode):
+        if mode not in SIGNATURE_MODES:
+            raise ValueError(f"Unknown signature mode '{mode}'")
+        self.signatures = mode
 
-        return self.ipc.json_loads(data)
+    def make_signature(self, what):
+        return make_signature(what, self.signatures)
 
     async def pcall(self, r, ffid, key, args, set_attr=False):
         created = {}
 
+        # JS objects passed by value get an ffid from us, which stays valid for as long
+        # as something on this side holds on to them
+        def adopt(v):
+            new_ffid = self.m.reserve()
+            proxy = (
+                self.m[v["extend"]] if "extend" in v else Proxy(self.executor, new_ffid)
+            )
+            created[v["r"]] = self.m.bind(new_ffid, proxy, weak=True)
+            return proxy
+
         # Convert special JSON objects to Python methods
         def process(json_input, lookup_key):
             if isinstance(json_input, dict):
@@ -317,15 +450,7 @@ class Bridge:
                     if isinstance(v, dict) and (lookup_key in v):
                         lookup = v[lookup_key]
                         if lookup == "":
-                            self.cur_ffid += 1
-                            proxy = (
-                                self.m[v["extend"]]
-                                if "extend" in v
-                                else Proxy(self.executor, self.cur_ffid)
-                            )
-                            self.weakmap[self.cur_ffid] = proxy
-                            json_input[k] = proxy
-                            created[v["r"]] = self.cur_ffid
+                            json_input[k] = adopt(v)
                         else:
                             json_input[k] = self.m[lookup]
                     else:
@@ -335,15 +460,7 @@ class Bridge:
                     if isinstance(v, dict) and (lookup_key in v):
                         lookup = v[lookup_key]
                         if lookup == "":
-                            self.cur_ffid += 1
-                            proxy = (
-                                self.m[v["extend"]]
-                                if "extend" in v
-                                else Proxy(self.executor, self.cur_ffid)
-                            )
-                            self.weakmap[self.cur_ffid] = proxy
-                            json_input[k] = proxy
-                            created[v["r"]] = self.cur_ffid
+                            json_input[k] = adopt(v)
                         else:
                             json_input[k] = self.m[lookup]
                     else:
@@ -365,17 +482,9 @@ class Bridge:
     # including arrays and dictionary/object maps, unlike what the .get
     # and .call methods do where they only return numeric/strings as
     # primitive values and everything else is an object refrence.
+    # Arrays and tables are sent as typed columns, see `columnar.encode`.
     async def value(self, r, ffid, keys, args):
-        v = self.m[ffid]
-
-        for key in keys:
-            t = getattr(v, str(key), None)
-            if t is None:
-                v = v[
-                    key
-                ]  # 🚨 If you get an error here, you called an undefined property
-            else:
-                v = t
+        v = self.resolve(ffid, keys)
 
         # TODO: do we realy want to worry about functions/classes here?
         # we're only supposed to send primitives, probably best to ignore
@@ -383,7 +492,68 @@ class Bridge:
         # payload = json.dumps(v, default=lambda arg: None)
         await self.q(r, "ser", v)
 
+    # Runs a list of operations in order and answers all of them in one frame. Any
+    # operation can stand in the result of an earlier one (usually its ffid) with
+    # {"$ref": i}. The batch stops at the first operation that errors.
+    async def batch(self, r, ffid, key, ops):
+        responses = []
+        results = []
+        token = current_batch.set(responses)
+        try:
+            for op in ops:
+                op = resolve_refs(op, results)
+                sent = len(responses)
+                await self.onMessage(
+                    op["r"], op["action"], op["ffid"], op["key"], op["val"]
+                )
+                final = responses[-1] if len(responses) > sent else None
+                results.append(final["val"] if final else None)
+                if final and final["key"] == "error":
+                    break
+        finally:
+            current_batch.reset(token)
+
+        await self.q(r, "batch", responses)
+
+    # This is the only reader of the socket. Requests get dispatched to run alongside
+    # each other, and everything else is JS answering a call Python made, which gets
+    # routed to whoever is waiting on it by request id.
+    async def listen(self):
+        async for data in self.ipc.websocket:
+            metrics.received(len(data))
+            if isinstance(data, str) and data[0] != "{":
+                continue
+
+            j = self.ipc.decode(data)
+            if j.get("action") == "cancel":
+                # never queued behind the very request it's cancelling
+                self.dispatcher.cancel(j["val"])
+            elif "action" in j:
+                self.dispatcher.submit(j)
+            else:
+                self.executor.resolve(j)
+
+    def close(self):
+        self.forget()
+        self.ipc.close()
+
+    def reset(self):
+        """Forgets everything the other side held, keeping the bridge itself usable."""
+        self.forget()
+        self.paths = PathCache()
+        self.ipc.clear()
+
+    def forget(self):
+        self.dispatcher.close()
+        self.executor.close()
+        self.m.clear()
+        for stream in self.streams.values():
+            self.loop.create_task(stream.close())
+        self.streams.clear()
+
     async def onMessage(self, r, action, ffid, key, args):
+        start = time.perf_counter()
+        failed = False
         try:
             res_or_coro = getattr(self, action)(r, ffid, key, args)
 
@@ -392,5 +562,9 @@ class Bridge:
 
             return res_or_coro
         except Exception:
+            failed = True
             traceback.print_exc()
             await self.q(r, "error", "", traceback.format_exc())
+        finally:
+            label = action if action in ACTIONS else "unknown"
+            metrics.request(label, time.perf_counter() - start, failed)
@@ -0,0 +1,82 @@
+import sys
+from typing import TYPE_CHECKING
+
+from . import framing
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any
+
+MISSING = object()
+
+
+def encode(obj: "Any", buffers: list, tables: bool = True) -> "Any":
+    """
+    Converts NumPy arrays, pandas tables and `array.array`s for sending to JS by value.
+    Numeric data becomes attachments JS views as typed arrays, tagged with their
+    dtype; anything else is converted to plain lists. Returns MISSING for any other
+    object. DataFrames and Series are only sent as columns when `tables` is set.
+
+    None of the libraries are imported here: if they haven't been imported already,
+    nothing can be an instance of them.
+    """
+    if (np := sys.modules.get("numpy")) is not None:
+        if isinstance(obj, np.ndarray):
+            return array(np, obj, buffers)
+        if isinstance(obj, np.generic):
+            return obj.item()
+
+    if tables and (pd := sys.modules.get("pandas")) is not None:
+        if isinstance(obj, pd.DataFrame):
+            return {
+                "columns": [str(c) for c in obj.columns],
+                "dtypes": [str(t) for t in obj.dtypes],
+                "data": [obj.iloc[:, i].to_numpy() for i in range(obj.shape[1])],
+                "index": index(pd, obj.index),
+                "length": len(obj),
+            }
+        if isinstance(obj, pd.Series):
+            return {
+                "name": None if obj.name is None else str(obj.name),
+                "dtype": str(obj.dtype),
+                "data": obj.to_numpy(),
+                "index": index(pd, obj.index),
+                "length": len(obj),
+            }
+
+    if (arrays := sys.modules.get("array")) is not None:
+        if isinstance(obj, arrays.array) and obj.typecode in "uw":
+            return obj.tounicode()
+    return MISSING
+
+
+def array(np: "Any", a: "Any", buffers: list) -> "Any":
+    if a.ndim == 0:
+        return a.item()
+
+    dtype = str(a.dtype)
+    kind = a.dtype.kind
+    if kind == "b":
+        a = a.view(np.uint8)
+    elif kind in "Mm":
+        # dates become milliseconds (since the epoch), which is what JS' Date takes
+        unit = "datetime64[ms]" if kind == "M" else "timedelta64[ms]"
+        ms = a.astype(unit).astype(np.float64)
+        ms[np.isnat(a)] = np.nan
+        a, dtype = ms, unit
+    elif kind == "f" and a.dtype.itemsize == 2:
+        a = a.astype(np.float32)
+    elif kind not in "iuf" or a.dtype.itemsize > 8:
+        # strings, objects and the like (ie. pandas' nullable and categorical columns)
+        return a.tolist()
+
+    # JS only reads native byte order, and attachments have to be contiguous
+    a = np.ascontiguousarray(a, dtype=a.dtype.newbyteorder("="))
+    placeholder = framing.attach(a, buffers)
+    placeholder["dtype"] = dtype
+    return placeholder
+
+
+def index(pd: "Any", idx: "Any") -> "Any":
+    if isinstance(idx, pd.RangeIndex) and idx.start == 0 and idx.step == 1:
+        return None
+    return idx.to_numpy()
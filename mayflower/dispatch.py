@@ -0,0 +1,190 @@
+import asyncio
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
+
+from .metrics import metrics
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any
+
+    from .bridge import Bridge
+
+# the dispatcher task running the current request, if any
+current_request: ContextVar["asyncio.Task | None"] = ContextVar(
+    "current_request", default=None
+)
+# when the current request has to be answered by (in `time.monotonic()` terms), if JS
+# gave it a deadline. calls into JS made on its behalf can't outlive it
+current_deadline: ContextVar[float | None] = ContextVar(
+    "current_deadline", default=None
+)
+# the ffids handed out while running the current request, which are released again if
+# it never gets to answer
+current_allocations: ContextVar[list[int] | None] = ContextVar(
+    "current_allocations", default=None
+)
+
+# actions which mutate the object(s) they target. anything that arrives after one of
+# these and touches the same ffid has to observe its effects, so it waits for it.
+# iterating advances the iterator, so it counts too
+WRITES = frozenset(("setval", "free", "iterate"))
+
+
+def footprint(j: dict) -> tuple[list[int], bool]:
+    """Returns the ffids a request touches, and whether it writes to them."""
+    action = j["action"]
+    if action == "batch":
+        targets, write = [], False
+        for op in j["val"]:
+            t, w = footprint(op)
+            targets.extend(t)
+            write |= w
+        return targets, write
+
+    targets = j["val"] if action == "free" else (j["ffid"],)
+    return [t for t in targets if isinstance(t, int)], action in WRITES
+
+
+class Dispatcher:
+    """
+    Runs the requests coming in over a single connection as concurrent tasks.
+
+    At most `max_concurrency` requests execute at once. Requests are only serialized
+    against each other when they touch the same ffid and at least one of them is a
+    write, so a slow call never holds up unrelated `get`s and `free`s.
+    """
+
+    def __init__(self, bridge: "Bridge", max_concurrency: int = 64):
+        self.bridge = bridge
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.tasks: set[asyncio.Task] = set()
+        # request id -> the task running it, so JS can cancel requests it gave up on
+        self.requests: dict[int, asyncio.Task] = {}
+        # ffid -> [last write, reads issued since that write]
+        self.order: dict[int, list] = {}
+        # requests blocked on a response from JS (keyed by task, None when Python
+        # called into JS outside of any request), along with how deeply. requests
+        # offloaded to worker threads park from those threads
+        self.parked: dict[asyncio.Task | None, int] = {}
+        self.parked_lock = threading.Lock()
+
+    def submit(self, j: dict) -> asyncio.Task:
+        targets, write = footprint(j)
+        deps = set()
+        for t in targets:
+            if entry := self.order.get(t):
+                last_write, reads = entry
+                if last_write is not None:
+                    deps.add(last_write)
+                if write:
+                    deps.update(reads)
+        # anything parked is waiting on JS, which may well be waiting on this request
+        # (ie. a callback), so never queue behind it or it'll deadlock
+        with self.parked_lock:
+            deps.difference_update(self.parked)
+            capped = not self.parked
+
+        task = asyncio.create_task(self._run(j, deps, capped))
+        self.tasks.add(task)
+        self.requests[j["r"]] = task
+        for t in targets:
+            if write:
+                self.order[t] = [task, set()]
+            else:
+                self.order.setdefault(t, [None, set()])[1].add(task)
+        task.add_done_callback(lambda task: self._done(task, j["r"], targets))
+        return task
+
+    async def _run(self, j: dict, deps: set[asyncio.Task], capped: bool) -> "Any":
+        current_request.set(asyncio.current_task())
+        allocated = []
+        current_allocations.set(allocated)
+        # how long JS is willing to wait, in ms. waiting on other requests counts too
+        if (budget := j.get("d")) is None:
+            try:
+                return await self._execute(j, deps, capped)
+            except asyncio.CancelledError:
+                self.bridge.release(allocated)
+                raise
+
+        current_deadline.set(time.monotonic() + budget / 1000)
+        try:
+            return await asyncio.wait_for(self._execute(j, deps, capped), budget / 1000)
+        except asyncio.TimeoutError:
+            self.bridge.release(allocated)
+            metrics.timeouts += 1
+            await self.bridge.q(j["r"], "error", "", timed_out(j["action"], budget))
+        except asyncio.CancelledError:
+            self.bridge.release(allocated)
+            raise
+
+    async def _execute(self, j: dict, deps: set[asyncio.Task], capped: bool) -> "Any":
+        if deps:
+            await asyncio.wait(deps)
+
+        if not capped:
+            return await self._call(j)
+        async with self.slots:
+            return await self._call(j)
+
+    async def _call(self, j: dict) -> "Any":
+        return await self.bridge.onMessage(
+            j["r"], j["action"], j["ffid"], j["key"], j["val"]
+        )
+
+    def _done(self, task: asyncio.Task, r: int, targets: list[int]):
+        self.tasks.discard(task)
+        if self.requests.get(r) is task:
+            del self.requests[r]
+        for t in targets:
+            if (entry := self.order.get(t)) is None:
+                continue
+            if entry[0] is task:
+                entry[0] = None
+            entry[1].discard(task)
+            if entry[0] is None and not entry[1]:
+                del self.order[t]
+
+    @contextmanager
+    def park(self):
+        """
+        Marks the current request as blocked on a response from JS for the duration of
+        the context. Requests that arrive in the meantime may be the callbacks it's
+        waiting on, so they bypass the concurrency cap and aren't ordered behind it.
+        """
+        task = current_request.get()
+        with self.parked_lock:
+            self.parked[task] = self.parked.get(task, 0) + 1
+        try:
+            yield
+        finally:
+            with self.parked_lock:
+                if self.parked[task] == 1:
+                    del self.parked[task]
+                else:
+                    self.parked[task] -= 1
+
+    def cancel(self, r: int):
+        """
+        Stops working on a request JS gave up on. Whatever it allocated for JS is
+        released, since the answer it was meant for will never be sent.
+        """
+        if (task := self.requests.pop(r, None)) is not None and not task.done():
+            metrics.cancelled += 1
+            task.cancel()
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+
+
+def timed_out(action: str, budget: float) -> str:
+    # formatted like any other error, so JS shows it the same way
+    try:
+        raise TimeoutError(f"'{action}' didn't finish within {budget}ms")
+    except TimeoutError:
+        return traceback.format_exc()
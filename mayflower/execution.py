@@ -0,0 +1,159 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import inspect
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any, Callable
+
+POLICIES = ("inline", "thread", "process")
+# the process pool only suits callables known to be picklable and pure, so it can only
+# be asked for per callable or per call
+DEFAULT_POLICIES = ("inline", "thread")
+POLICY_ATTR = "__mayflower_policy__"
+
+
+def offload(fn: "Callable | None" = None, *, policy: str = "thread"):
+    """
+    Marks a callable to run with the given execution policy whenever JS calls it,
+    regardless of the server's default. Usable bare (`@offload`) or with a policy
+    (`@offload(policy="process")`).
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown execution policy '{policy}'")
+
+    def mark(fn):
+        setattr(fn, POLICY_ATTR, policy)
+        return fn
+
+    return mark(fn) if fn is not None else mark
+
+
+def picklable(what: "Any") -> bool:
+    try:
+        pickle.dumps(what)
+    except Exception:
+        return False
+    return True
+
+
+class ExecutionPool:
+    """
+    Decides where synchronous callables invoked from JS run: in a thread pool
+    ("thread"), directly on the event loop ("inline"), or in a process pool ("process")
+    for picklable pure functions. Waiting on JS blocks, so only callables that never
+    call into JS can run inline. Coroutine functions always run on the loop, and calls
+    that can't be pickled run in a thread rather than a process.
+    """
+
+    def __init__(self, policy: str = "thread", max_workers: int | None = None):
+        if policy not in DEFAULT_POLICIES:
+            raise ValueError(f"'{policy}' can't be the default execution policy")
+
+        self.policy = policy
+        self.max_workers = max_workers
+        self._threads: ThreadPoolExecutor | None = None
+        self._processes: ProcessPoolExecutor | None = None
+
+        # thread pool bookkeeping: how many calls are running on it, and how many of
+        # those are blocked waiting on JS
+        self.thread_capacity = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.busy = 0
+        self.blocked = 0
+        self._lock = threading.Lock()
+
+    @property
+    def threads(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(
+                self.thread_capacity, thread_name_prefix="mayflower"
+            )
+        return self._threads
+
+    @property
+    def processes(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            # forking a process with a running event loop (and its threads) isn't safe
+            self._processes = ProcessPoolExecutor(
+                self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._processes
+
+    def policy_for(self, fn: "Callable", override: str | None = None) -> str:
+        if inspect.iscoroutinefunction(fn):
+            return "inline"
+        if override is not None:
+            if override not in POLICIES:
+                raise ValueError(f"Unknown execution policy '{override}'")
+            return override
+        return getattr(fn, POLICY_ATTR, None) or self.policy
+
+    async def run(
+        self, fn: "Callable", args: list, kwargs: dict, policy: str = "inline"
+    ) -> "Any":
+        if policy == "inline":
+            return fn(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        if policy == "thread":
+            # carry the request's context over so calls back into JS are attributed
+            # to the right request
+            ctx = contextvars.copy_context()
+            call = functools.partial(ctx.run, fn, *args, **kwargs)
+            with self._lock:
+                # when the workers are all taken and some are waiting on JS, this may
+                # well be the callback JS needs to answer them. queueing it behind
+                # them would deadlock, so it gets a thread of its own
+                overflow = self.busy >= self.thread_capacity and self.blocked
+                self.busy += 1
+            try:
+                if overflow:
+                    return await self._overflow(call)
+                return await loop.run_in_executor(self.threads, call)
+            finally:
+                with self._lock:
+                    self.busy -= 1
+
+        call = functools.partial(fn, *args, **kwargs)
+        if picklable(call):
+            return await loop.run_in_executor(self.processes, call)
+        # ie. a closure, or something holding a proxy to JS
+        return await self.run(fn, args, kwargs, "thread")
+
+    async def _overflow(self, call: "Callable") -> "Any":
+        result = concurrent.futures.Future()
+
+        def target():
+            if result.set_running_or_notify_cancel():
+                try:
+                    result.set_result(call())
+                except BaseException as e:
+                    result.set_exception(e)
+
+        threading.Thread(target=target, name="mayflower-overflow", daemon=True).start()
+        return await asyncio.wrap_future(result)
+
+    @contextmanager
+    def block(self):
+        """Marks a worker thread as blocked on JS for the duration of the context."""
+        with self._lock:
+            self.blocked += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.blocked -= 1
+
+    def shutdown(self):
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,132 @@
+/**
+ * Binary websocket frames, used whenever a message carries raw buffers. The
+ * layout is
+ *
+ *   [u8 flags][u32 header length][header][attachment 0][attachment 1]...
+ *
+ * where the header is the JSON `{"b": [attachment lengths], "m": message}`,
+ * and every buffer in the message is replaced by a `{"$buf": i, "t": type}`
+ * placeholder. The header and each attachment are padded to 8 bytes so any
+ * attachment can be viewed as a typed array in place.
+ *
+ * Frames with the COMPRESSED flag set are instead
+ * `[u8 flags][u32 kind][deflated]`, where inflating gives either a text
+ * message or a whole binary frame, per `kind`.
+ */
+
+const PREFIX = 5;
+const ALIGN = 8;
+
+const COMPRESSED = 1;
+const TEXT = 0;
+
+const TYPES = {
+  Int8Array,
+  Uint8Array,
+  Uint8ClampedArray,
+  Int16Array,
+  Uint16Array,
+  Int32Array,
+  Uint32Array,
+  BigInt64Array,
+  BigUint64Array,
+  Float32Array,
+  Float64Array,
+};
+
+const encoder = new TextEncoder();
+const decoder = new TextDecoder();
+const padding = (n) => (ALIGN - (n % ALIGN)) % ALIGN;
+
+export function isBuffer(v) {
+  return v instanceof ArrayBuffer || ArrayBuffer.isView(v);
+}
+
+/**
+ * Queues a buffer as an attachment and returns the placeholder to serialize
+ * in its stead.
+ */
+export function attach(v, buffers) {
+  buffers.push(v);
+  const t = v.constructor.name in TYPES ? v.constructor.name : "Uint8Array";
+  return { $buf: buffers.length - 1, t };
+}
+
+/**
+ * Builds a binary frame from an already serialized message and its
+ * attachments. A Blob lets the browser send the attachments without copying
+ * them into one buffer first.
+ */
+export function pack(json, buffers, flags = 0) {
+  const lens = buffers.map((b) => b.byteLength);
+  const header = encoder.encode(`{"b":${JSON.stringify(lens)},"m":${json}}`);
+  const hlen = header.byteLength + padding(PREFIX + header.byteLength);
+
+  const prefix = new Uint8Array(PREFIX + hlen).fill(0x20); // pad with spaces
+  const view = new DataView(prefix.buffer);
+  view.setUint8(0, flags);
+  view.setUint32(1, hlen);
+  prefix.set(header, PREFIX);
+
+  const parts = [prefix];
+  for (const b of buffers) {
+    parts.push(b);
+    const pad = padding(b.byteLength);
+    if (pad) parts.push(new Uint8Array(pad));
+  }
+  return new Blob(parts);
+}
+
+export function isCompressed(data) {
+  return (
+    data instanceof ArrayBuffer && new DataView(data).getUint8(0) & COMPRESSED
+  );
+}
+
+/**
+ * Parses a compressed frame. Inflating is asynchronous, unlike `unpack`.
+ */
+export async function inflate(buffer) {
+  const stream = new Blob([new Uint8Array(buffer, PREFIX)])
+    .stream()
+    .pipeThrough(new DecompressionStream("deflate"));
+  const raw = await new Response(stream).arrayBuffer();
+  if (new DataView(buffer).getUint32(1) === TEXT) {
+    return JSON.parse(decoder.decode(raw));
+  }
+  return unpack(raw);
+}
+
+/**
+ * Parses a binary frame, restoring its attachments as typed arrays over the
+ * frame's buffer.
+ */
+export function unpack(buffer) {
+  const hlen = new DataView(buffer).getUint32(1);
+  const header = JSON.parse(
+    decoder.decode(new Uint8Array(buffer, PREFIX, hlen)),
+  );
+
+  let offset = PREFIX + hlen;
+  const spans = header.b.map((len) => {
+    const span = [offset, len];
+    offset += len + padding(len);
+    return span;
+  });
+
+  const restore = (v) => {
+    if (v && typeof v === "object") {
+      if ("$buf" in v) {
+        const [at, len] = spans[v.$buf];
+        const Type = TYPES[v.t] ?? Uint8Array;
+        const arr = new Type(buffer, at, len / Type.BYTES_PER_ELEMENT);
+        if (v.shape) arr.shape = v.shape;
+        if (v.dtype) arr.dtype = v.dtype;
+        return arr;
+      }
+      for (const k in v) v[k] = restore(v[k]);
+    }
+    return v;
+  };
+  return restore(header.m);
+}
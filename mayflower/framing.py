@@ -0,0 +1,151 @@
+import struct
+import sys
+import zlib
+from typing import TYPE_CHECKING
+
+import orjson
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any
+
+# Binary websocket frames, used whenever a message carries raw buffers. The layout is
+#
+#   [u8 flags][u32 header length][header][attachment 0][attachment 1]...
+#
+# where the header is the JSON `{"b": [attachment lengths], "m": message}`, and every
+# buffer in the message is replaced by a `{"$buf": i, "t": typed array}` placeholder.
+# The header and each attachment are padded to 8 bytes so that JS can view any of the
+# attachments as a typed array in place.
+#
+# Frames with the COMPRESSED flag set are instead `[u8 flags][u32 kind][deflated]`,
+# where inflating gives either a text message or a whole binary frame, per `kind`.
+PREFIX = struct.Struct("!BI")
+ALIGN = 8
+
+COMPRESSED = 1
+TEXT, BINARY = 0, 1
+
+# typed array -> the memoryview format it maps to
+FORMATS = {
+    "Int8Array": "b",
+    "Uint8Array": "B",
+    "Uint8ClampedArray": "B",
+    "Int16Array": "h",
+    "Uint16Array": "H",
+    "Int32Array": "i",
+    "Uint32Array": "I",
+    "BigInt64Array": "q",
+    "BigUint64Array": "Q",
+    "Float32Array": "f",
+    "Float64Array": "d",
+}
+NATIVE = "@=" + ("<" if sys.byteorder == "little" else ">")
+# types known not to support the buffer protocol
+UNBUFFERED: set[type] = set()
+
+
+def padding(n: int) -> int:
+    return -n % ALIGN
+
+
+def typed_array(view: memoryview) -> str:
+    """Picks the typed array JS should see a buffer as, falling back to raw bytes."""
+    fmt = view.format.lstrip(NATIVE)
+    bits = view.itemsize * 8
+    if len(fmt) != 1:
+        return "Uint8Array"
+    if fmt in "fd":
+        return f"Float{bits}Array"
+    if fmt in "bhilqn":
+        return "BigInt64Array" if bits == 64 else f"Int{bits}Array"
+    if fmt in "BHILQN":
+        return "BigUint64Array" if bits == 64 else f"Uint{bits}Array"
+    return "Uint8Array"
+
+
+def attach(obj: "Any", buffers: list[memoryview]) -> dict | None:
+    """
+    Queues anything that supports the buffer protocol as an attachment and returns the
+    placeholder to serialize in its stead, or None if `obj` isn't a buffer.
+    """
+    if type(obj) in UNBUFFERED:
+        return None
+    try:
+        view = memoryview(obj)
+    except TypeError:
+        # types can't start supporting the buffer protocol later on, so there's no
+        # need to pay for the exception again
+        UNBUFFERED.add(type(obj))
+        return None
+
+    placeholder = {"$buf": len(buffers), "t": typed_array(view)}
+    if view.ndim > 1:
+        placeholder["shape"] = view.shape
+    # attachments are sent as raw bytes, which can only be done without a copy when
+    # the buffer is contiguous
+    buffers.append(view.cast("B") if view.c_contiguous else memoryview(view.tobytes()))
+    return placeholder
+
+
+def pack(data: bytes, buffers: list[memoryview], flags: int = 0) -> list:
+    """
+    Builds a binary frame from an already serialized message and its attachments. The
+    frame is returned as a list of fragments so the attachments are never copied.
+    """
+    lens = orjson.dumps([len(b) for b in buffers])
+    header = b'{"b":' + lens + b',"m":' + data + b"}"
+    header += b" " * padding(PREFIX.size + len(header))
+
+    fragments = [PREFIX.pack(flags, len(header)) + header]
+    for buffer in buffers:
+        fragments.append(buffer)
+        if pad := padding(len(buffer)):
+            fragments.append(bytes(pad))
+    return fragments
+
+
+def compress(data: "str | list", level: int = 1) -> bytes:
+    """Deflates a message, text or binary, into a compressed binary frame."""
+    if isinstance(data, str):
+        kind, raw = TEXT, data.encode()
+    else:
+        kind, raw = BINARY, b"".join(data)
+    return PREFIX.pack(COMPRESSED, kind) + zlib.compress(raw, level)
+
+
+def unpack(data: bytes, limit: int | None = None) -> "Any":
+    """
+    Parses a binary frame, restoring its attachments as memoryviews into `data`.
+    Compressed frames that would inflate past `limit` bytes are rejected.
+    """
+    flags, hlen = PREFIX.unpack_from(data)
+    if flags & COMPRESSED:
+        inflate = zlib.decompressobj()
+        raw = inflate.decompress(memoryview(data)[PREFIX.size :], limit or 0)
+        if inflate.unconsumed_tail:
+            raise ValueError(f"Compressed frame inflates past {limit} bytes")
+        return orjson.loads(raw) if hlen == TEXT else unpack(raw, limit)
+
+    frame = memoryview(data)
+    offset = PREFIX.size + hlen
+    header = orjson.loads(frame[PREFIX.size : offset])
+
+    views = []
+    for length in header["b"]:
+        views.append(frame[offset : offset + length])
+        offset += length + padding(length)
+    return restore(header["m"], views)
+
+
+def restore(what: "Any", views: list[memoryview]) -> "Any":
+    if isinstance(what, dict):
+        if "$buf" in what:
+            view = views[what["$buf"]]
+            fmt = FORMATS.get(what.get("t"), "B")
+            if "shape" in what:
+                return view.cast(fmt, what["shape"])
+            return view if fmt == "B" else view.cast(fmt)
+        return {k: restore(v, views) for k, v in what.items()}
+    if isinstance(what, list):
+        return [restore(v, views) for v in what]
+    return what
@@ -0,0 +1,180 @@
+import heapq
+import sys
+import time
+import weakref
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any
+
+# An ffid is `generation << SLOT_BITS | slot`. Freeing a slot bumps its generation, so
+# a stale ffid held by JS can never reach whatever reuses the slot. Generations start
+# at 1, which also keeps our ffids well clear of the ones JS hands out (from 10000).
+SLOT_BITS = 24
+SLOT_MASK = (1 << SLOT_BITS) - 1
+# ffids have to survive the trip through a JS number
+MAX_GENERATION = (1 << (53 - SLOT_BITS)) - 1
+
+EMPTY = object()
+
+
+class HandleTable:
+    """
+    The objects a single connection has handed out to JS, keyed by ffid. Slot 0 is
+    always the root namespace. Entries can be weak, in which case they disappear once
+    nothing else holds on to the object.
+
+    It supports the read side of the mapping protocol (`[]`, `in`, `del`, `len`), and
+    releases everything at once when the connection goes away.
+    """
+
+    def __init__(self, root: "Any", leak_threshold: int = 10_000):
+        self.values: list = [root]
+        self.gens: list[int] = [0]
+        self.born: list[float] = [time.monotonic()]
+        self.weak: set[int] = set()
+        self.vacant: list[int] = []
+        # weak entries that died, possibly on another thread. they're reclaimed on
+        # the next allocation rather than from the weakref callback
+        self.dead: list[int] = []
+        self.live = 0
+        self.allocated = 0
+        self.released = 0
+        self.stale = 0
+        self.leak_threshold = leak_threshold
+
+    def add(self, value: "Any", weak: bool = False) -> int:
+        return self.bind(self.reserve(), value, weak)
+
+    def reserve(self) -> int:
+        """Allocates an ffid up front, for objects that need to know their own."""
+        while self.dead:
+            self._reap(self.dead.pop())
+
+        if self.vacant:
+            slot = self.vacant.pop()
+        else:
+            slot = len(self.values)
+            if slot > SLOT_MASK:
+                raise MemoryError("Out of handles; is JS freeing its objects?")
+            self.values.append(EMPTY)
+            self.gens.append(0)
+            self.born.append(0.0)
+
+        gen = self.gens[slot] % MAX_GENERATION + 1
+        self.gens[slot] = gen
+        self.born[slot] = time.monotonic()
+        self.values[slot] = None
+
+        self.live += 1
+        self.allocated += 1
+        if self.live > self.leak_threshold:
+            self._warn_leak()
+        return gen << SLOT_BITS | slot
+
+    def bind(self, ffid: int, value: "Any", weak: bool = False) -> int:
+        slot = self._slot(ffid)
+        if weak:
+            self.values[slot] = weakref.ref(value, lambda _: self.dead.append(ffid))
+            self.weak.add(slot)
+        else:
+            self.values[slot] = value
+            self.weak.discard(slot)
+        return ffid
+
+    def _slot(self, ffid: "Any") -> int:
+        if not isinstance(ffid, int) or ffid < 0:
+            raise KeyError(ffid)
+        slot = ffid & SLOT_MASK
+        if (
+            slot >= len(self.values)
+            or self.gens[slot] != ffid >> SLOT_BITS
+            or self.values[slot] is EMPTY
+        ):
+            self.stale += 1
+            raise KeyError(ffid)
+        return slot
+
+    def __getitem__(self, ffid: int) -> "Any":
+        slot = self._slot(ffid)
+        if (value := self._peek(slot)) is None and slot in self.weak:
+            raise KeyError(ffid)
+        return value
+
+    def __delitem__(self, ffid: int):
+        slot = self._slot(ffid)
+        if slot == 0:
+            raise KeyError("The root namespace can't be freed")
+        self._release(slot)
+
+    def __contains__(self, ffid: "Any") -> bool:
+        try:
+            self._slot(ffid)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return self.live
+
+    def _release(self, slot: int):
+        self.values[slot] = EMPTY
+        self.weak.discard(slot)
+        self.vacant.append(slot)
+        self.live -= 1
+        self.released += 1
+
+    def _reap(self, ffid: int):
+        slot = ffid & SLOT_MASK
+        # the slot may have been explicitly freed (and reused) since
+        if self.gens[slot] == ffid >> SLOT_BITS and self._peek(slot) is None:
+            self._release(slot)
+
+    def _peek(self, slot: int) -> "Any":
+        value = self.values[slot]
+        return value() if slot in self.weak else value
+
+    def clear(self):
+        """Releases every handle but the root, ie. when the connection closes."""
+        for slot in range(1, len(self.values)):
+            if self.values[slot] is not EMPTY:
+                self._release(slot)
+        self.dead.clear()
+
+    def oldest(self, n: int = 10) -> list[tuple[int, str, float]]:
+        """The `n` longest lived handles, as (ffid, type, age in seconds)."""
+        now = time.monotonic()
+        slots = (s for s in range(1, len(self.values)) if self.values[s] is not EMPTY)
+        return [
+            (
+                self.gens[s] << SLOT_BITS | s,
+                type(self._peek(s)).__name__,
+                round(now - self.born[s], 3),
+            )
+            for s in heapq.nsmallest(n, slots, key=self.born.__getitem__)
+        ]
+
+    def stats(self) -> dict:
+        # shallow sizes only, anything deeper would mean walking every object graph
+        size = sum(
+            sys.getsizeof(self.values[s])
+            for s in range(1, len(self.values))
+            if self.values[s] is not EMPTY and s not in self.weak
+        )
+        return {
+            "live": self.live,
+            "slots": len(self.values) - 1,
+            "allocated": self.allocated,
+            "released": self.released,
+            "stale": self.stale,
+            "bytes": size,
+            "oldest": self.oldest(),
+        }
+
+    def _warn_leak(self):
+        print(
+            f"Mayflower: {self.live} live handles on one connection, JS may be leaking "
+            f"Python objects. Oldest: {self.oldest(5)}",
+            file=sys.stderr,
+        )
+        self.leak_threshold *= 2
@@ -0,0 +1,99 @@
+import importlib
+import importlib.util
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Iterable
+
+
+class ImportTimes:
+    """
+    How long each module imported on behalf of JS took to load, and how many modules
+    came along with it (roughly, when imports overlap). Only cold imports are
+    recorded, since anything already in `sys.modules` is free.
+    """
+
+    def __init__(self):
+        self.entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, loaded: int, source: str):
+        with self._lock:
+            self.entries[name] = {
+                "seconds": round(seconds, 6),
+                "modules": loaded,
+                "source": source,
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = dict(self.entries)
+        return {
+            "total": round(sum(e["seconds"] for e in entries.values()), 6),
+            "modules": dict(
+                sorted(entries.items(), key=lambda e: e[1]["seconds"], reverse=True)
+            ),
+        }
+
+
+# shared by every connection, since imports are per-process anyways
+times = ImportTimes()
+
+
+def load(name: str, source: str = "request") -> ModuleType:
+    if (module := sys.modules.get(name)) is not None:
+        return module
+
+    before = len(sys.modules)
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    times.record(name, time.perf_counter() - start, len(sys.modules) - before, source)
+    return module
+
+
+def preload(names: "Iterable[str]", max_workers: int | None = None) -> dict:
+    """
+    Imports `names` concurrently, so the cost is paid at startup rather than by the
+    first request that uses them. Modules that fail to import are reported and
+    skipped; JS will get the error itself if it asks for them.
+    """
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+
+    def attempt(name):
+        try:
+            load(name, "preload")
+            return True
+        except Exception as e:
+            print(f"Mayflower couldn't preload '{name}': {e!r}", file=sys.stderr)
+            return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers or len(names), "mayflower-preload") as pool:
+        loaded = sum(pool.map(attempt, names))
+
+    print(f"Mayflower preloaded {loaded} modules in {time.perf_counter() - start:.2f}s")
+    return times.stats()
+
+
+def submodule(module: ModuleType, name: str) -> ModuleType | None:
+    """
+    Imports `module.name` on first access, for packages that don't import their
+    submodules themselves. Returns None if there's no such submodule.
+    """
+    if not hasattr(module, "__path__") or not name.isidentifier():
+        return None
+
+    qualified = f"{module.__name__}.{name}"
+    try:
+        if importlib.util.find_spec(qualified) is None:
+            return None
+    except (ImportError, ValueError):
+        return None
+    return load(qualified)
@@ -1 +1,57 @@
 export function python(module: string): Promise<any>;
+
+type Target = number | { ffid: number } | BatchRef;
+type BatchRef = Readonly<{ $ref: number }>;
+
+export interface Batch {
+  get(target: Target, stack: (string | number)[]): BatchRef;
+  call(
+    target: Target,
+    stack: (string | number)[],
+    args?: any[],
+    kwargs?: Record<string, any>,
+  ): BatchRef;
+  set(
+    target: Target,
+    stack: (string | number)[],
+    prop: string,
+    val: any,
+  ): BatchRef;
+  value(target: Target, stack: (string | number)[]): BatchRef;
+  length(target: Target, stack: (string | number)[]): BatchRef;
+  free(ffids: number[]): BatchRef;
+}
+
+export namespace python {
+  function batch(
+    build: (batch: Batch) => unknown,
+    timeout?: number,
+  ): Promise<any[]>;
+  function reset(): Promise<void>;
+  function setSignatures(mode: "eager" | "bounded" | "lazy"): Promise<void>;
+  function stats(): Promise<Record<string, any>>;
+  function memoize<T>(
+    target: T,
+    options?: { maxsize?: number; ttl?: number; max_bytes?: number },
+  ): Promise<T>;
+  function invalidate(target?: any): Promise<void>;
+  function memos(): Promise<
+    Record<
+      string,
+      {
+        entries: number;
+        bytes: number;
+        hits: number;
+        misses: number;
+        skipped: number;
+      }
+    >
+  >;
+  function imports(): Promise<{
+    total: number;
+    modules: Record<
+      string,
+      { seconds: number; modules: number; source: "preload" | "request" }
+    >;
+  }>;
+}
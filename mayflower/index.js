@@ -1,6 +1,6 @@
 import { WebsocketCom } from "./interface.js";
 
-import { Bridge } from "./bridge.js";
+import { Batch, Bridge } from "./bridge.js";
 
 const com = new WebsocketCom();
 const bridge = new Bridge(com);
@@ -61,15 +61,70 @@ export function python(file) {
   return root.python(file);
 }
 
+/**
+ * Runs several bridge operations in a single round trip. `build` receives a
+ * `Batch` to queue operations on; resolves with all of their results.
+ */
+python.batch = async (build, timeout) => {
+  const batch = new Batch();
+  await build(batch);
+  return bridge.batch(batch, timeout);
+};
+
 python.exit = () => {
   bridge.end();
   com.end();
 };
 
+/**
+ * Starts over with a new Python session, dropping everything held in the old
+ * one. Under `--template` that's a fresh fork of the server, so nothing done
+ * before (ie. by another spec) is left over; otherwise modules stay as they were.
+ */
+python.reset = () => {
+  bridge.reset();
+  return com.reset();
+};
+
 python.setFastMode = (val) => {
   root.sendInspect(!val);
 };
 
+/**
+ * Picks how much of a Python object's repr is sent along with it: "eager" (all
+ * of it), "bounded" (a short summary) or "lazy" (none, until `toString()`).
+ */
+python.setSignatures = (mode) => root.signatures(mode);
+
+/**
+ * How long each module Python imported for us took to load, slowest first.
+ */
+python.imports = async () => (await root.imports()).valueOf();
+
+/**
+ * Marks a Python function, or every function of a module, as pure, so calling
+ * it again with the same arguments gets the earlier result without running it.
+ * Options are `maxsize`, `ttl` (in seconds) and `max_bytes`.
+ */
+python.memoize = (target, options) =>
+  options ? root.memoize$(target, options) : root.memoize(target);
+
+/**
+ * Forgets the results cached for a memoized function or module, or for
+ * everything if none is given.
+ */
+python.invalidate = (target) => root.invalidate(target ?? null);
+
+/**
+ * Hits, misses and sizes of each memoized function or module's cache.
+ */
+python.memos = async () => (await root.memos()).valueOf();
+
+/**
+ * Request counts and latencies, traffic and handle counts for the Python server.
+ */
+python.stats = () => bridge.stats();
+
 console._log = console.log;
 console.log = (...args) => {
   const nargs = [];
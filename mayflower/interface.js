@@ -1,28 +1,151 @@
+import { inflate, isCompressed, unpack } from "./framing.js";
+
+const RECONNECT_DELAY = 500;
+const RECONNECT_ATTEMPTS = 20;
+
+const encoder = new TextEncoder();
+const decoder = new TextDecoder();
+
+// Under Node we share a machine with Python, and can hand big messages over
+// through shared memory rather than the socket. Browsers can't, so never ask to.
+async function sharedMemory() {
+  if (!globalThis.process?.versions?.node) return null;
+  try {
+    return await import("node:fs");
+  } catch {
+    return null;
+  }
+}
+
+// Identifies our session to Python, so it survives reconnects. Browsers keep it
+// across reloads too, which then resume the session rather than start over.
+function sessionToken(fresh = false) {
+  const stored = globalThis.sessionStorage?.getItem("mayflower-session");
+  if (stored && !fresh) return stored;
+  const token = crypto.randomUUID();
+  globalThis.sessionStorage?.setItem("mayflower-session", token);
+  return token;
+}
+
 export class WebsocketCom {
   constructor() {
     this.handlers = {};
     this.sendQ = [];
+    this.session = sessionToken();
+    this.opened = false;
+    this.attempts = 0;
     this.start();
   }
 
   async start() {
-    this.sock = new WebSocket("ws://localhost:8768");
-    this.sock.onmessage = (message) => {
-      const msg = message.data;
-      const j = JSON.parse(msg);
-      if (j.c === "stderr") console.log("PyE", msg.val);
-      else if (j.c === "stdout") console.log("PyO", msg.val);
-      else this.receive(j);
+    // once we've been connected, reconnecting resumes with everything we hold
+    const resume = this.opened ? 1 : 0;
+    this.fs ??= await sharedMemory();
+    // until Python says otherwise (again), everything goes over the socket
+    this.shared = null;
+    const shm = this.fs ? 1 : 0;
+    this.sock = new WebSocket(
+      `ws://localhost:8768/?session=${this.session}&resume=${resume}&shm=${shm}`,
+    );
+    this.sock.binaryType = "arraybuffer";
+    this.sock.onmessage = ({ data }) => {
+      // compressed frames are inflated asynchronously, and anything arriving in
+      // the meantime has to wait its turn
+      if (this.inflating || isCompressed(data)) {
+        const next = (this.inflating ?? Promise.resolve())
+          .then(() => (isCompressed(data) ? inflate(data) : this.decode(data)))
+          .then((j) => this.dispatch(j))
+          .catch(console.error);
+        this.inflating = next;
+        next.then(() => {
+          if (this.inflating === next) this.inflating = null;
+        });
+      } else {
+        this.dispatch(this.decode(data));
+      }
     };
     this.sock.onopen = () => {
-      // flush any messages queued during initialization
-      for (const q of this.sendQ) {
+      this.opened = true;
+      this.attempts = 0;
+      // only now that Python has us again can the session we reset be let go
+      this.previous?.close(1000);
+      this.previous = null;
+      // flush any messages queued during initialization or while reconnecting
+      const queued = this.sendQ;
+      this.sendQ = [];
+      for (const q of queued) {
         this.sock.send(q);
       }
     };
+    this.sock.onclose = () => {
+      if (this.ended || ++this.attempts > RECONNECT_ATTEMPTS) return;
+      setTimeout(() => this.start(), RECONNECT_DELAY);
+    };
     this.sock.onerror = console.error;
   }
 
+  decode(data) {
+    return data instanceof ArrayBuffer ? unpack(data) : JSON.parse(data);
+  }
+
+  dispatch(j) {
+    // messages Python had ready at the same time arrive together, as an array
+    for (const m of Array.isArray(j) ? j : [j]) {
+      if (m.c === "shm") this.dispatch(this.readShared(m));
+      else if (m.c === "shared") this.shared = m;
+      else if (m.c === "stderr") console.log("PyE", m.val);
+      else if (m.c === "stdout") console.log("PyO", m.val);
+      else this.receive(m);
+    }
+  }
+
+  // Maps a message Python left in shared memory, see `shared.py`
+  readShared({ path, kind }) {
+    const data = this.fs.readFileSync(path);
+    this.fs.unlinkSync(path);
+    if (kind === 0) return JSON.parse(decoder.decode(data));
+    // large reads get a buffer of their own, which the frame can be viewed over
+    const { buffer, byteOffset, byteLength } = data;
+    const own = byteOffset === 0 && byteLength === buffer.byteLength;
+    return unpack(
+      own ? buffer : buffer.slice(byteOffset, byteOffset + byteLength),
+    );
+  }
+
+  async writeShared(what) {
+    const text = typeof what === "string";
+    const data = text
+      ? encoder.encode(what)
+      : new Uint8Array(await what.arrayBuffer());
+    const { dir, prefix } = this.shared;
+    const path = `${dir}/${prefix}${crypto.randomUUID()}`;
+    this.fs.writeFileSync(path, data, { mode: 0o600 });
+    const kind = text ? 0 : 1;
+    return JSON.stringify({ c: "shm", path, kind, size: data.byteLength });
+  }
+
+  isLarge(what) {
+    const size = typeof what === "string" ? what.length : what.size;
+    return this.shared && size >= this.shared.threshold;
+  }
+
+  send(what) {
+    // big messages are written out asynchronously, and anything sent in the
+    // meantime has to wait its turn
+    if (this.writing || this.isLarge(what)) {
+      const next = (this.writing ?? Promise.resolve())
+        .then(() => (this.isLarge(what) ? this.writeShared(what) : what))
+        .then((data) => this.sock.send(data))
+        .catch(console.error);
+      this.writing = next;
+      next.then(() => {
+        if (this.writing === next) this.writing = null;
+      });
+    } else {
+      this.sock.send(what);
+    }
+  }
+
   receive(j) {
     console.debug("[py -> js]", j);
     if (this.handlers[j.c]) {
@@ -48,11 +171,28 @@ export class WebsocketCom {
   writeRaw(what, r, cb) {
     console.debug("[js -> py]", what);
     if (!this.sock || this.sock.readyState != 1) this.sendQ.push(what);
-    else this.sock.send(what);
+    else this.send(what);
     this.register(r, cb);
   }
 
+  // Starts a new session on a new connection, leaving the old one behind
+  reset() {
+    const previous = this.sock;
+    if (previous) {
+      previous.onmessage = previous.onclose = null;
+      if (previous.readyState === 1) this.previous = previous;
+      else previous.close(1000);
+    }
+    this.sock = null;
+    this.session = sessionToken(true);
+    this.opened = false;
+    this.attempts = 0;
+    return this.start();
+  }
+
   end() {
-    this.sock?.close();
+    // a normal closure tells Python we're done, rather than about to reconnect
+    this.ended = true;
+    this.sock?.close(1000);
   }
 }
@@ -1,68 +1,417 @@
 import asyncio
+import collections
+import functools
+import os
 import signal
+import socket
+import sys
+import tempfile
+import time
+from contextlib import AsyncExitStack, suppress
 from typing import TYPE_CHECKING
+from urllib.parse import parse_qs, urlsplit
 
 import orjson
 from websockets.exceptions import ConnectionClosed
-from websockets.server import serve
+from websockets.server import WebSocketServerProtocol, serve
 
+from . import columnar, framing
 from .bridge import Bridge
+from .execution import ExecutionPool
+from .metrics import metrics
+from .metrics import serve as serve_metrics
+from .session import Session
+from .shared import SharedFrames
 
 if TYPE_CHECKING:  # pragma: no cover
-    from typing import Any
+    from typing import Any, Awaitable, Callable
+
+HOST = "localhost"
+PORT = 8768
+
+# producers wait once this many bytes are queued for the socket
+HIGH_WATER = 4 << 20
+# text messages queued together are sent as a single JSON array frame, up to this size
+COALESCE_LIMIT = 64 << 10
+COMPRESS_THRESHOLD = None
+SHM_THRESHOLD = None
 
 
 class IPC:
-    def __init__(self, websocket):
+    """
+    The connection's outbound side. Messages are queued and written by a single task,
+    which sends the text ones that are ready together as one frame. Once `high_water`
+    bytes are queued, senders wait for the socket to catch up.
+    """
+
+    def __init__(
+        self,
+        websocket,
+        resumable: bool = False,
+        high_water: int = HIGH_WATER,
+        compress_threshold: int | None = COMPRESS_THRESHOLD,
+    ):
         self.websocket = websocket
+        # a resumable connection holds on to whatever it couldn't send while the socket
+        # was down, and sends it once a new one is attached
+        self.resumable = resumable
+        self.high_water = high_water
+        # text frames at least this big are deflated, if it makes them any smaller
+        self.compress_threshold = compress_threshold
+        # frames big enough are handed over through shared memory instead, for clients
+        # that can map it
+        self.shared: SharedFrames | None = None
+        # (encoded message, size)
+        self.outbox: collections.deque[tuple[str | list, int]] = collections.deque()
+        self.queued = 0
+        self.wakeup = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.writable.set()
+        self.writer: asyncio.Task | None = None
+        self.closed = False
+        # failed writes, and the latest reason why
+        self.errors = 0
+        self.last_error: BaseException | None = None
 
-    def _default(self, obj):
+    def _default(self, obj, buffers=None, fallback=None):
         if attr := getattr(obj.__class__, "__json__", None):
             return attr(obj)
+        if buffers is not None:
+            # tables are only sent by value when JS asked for a value, rather than
+            # for anything it could get a reference to instead
+            block = columnar.encode(obj, buffers, tables=fallback is None)
+            if block is not columnar.MISSING:
+                return block
+            if placeholder := framing.attach(obj, buffers):
+                return placeholder
+        if fallback is not None:
+            return fallback(obj)
 
         raise TypeError()
 
     def json_loads(self, data: bytes) -> "Any":
         return orjson.loads(data)
 
-    def json_dumps(self, what: "Any") -> str:
-        # browsers only support 53-bit integers, while Python supports 64-bit
-        return orjson.dumps(
-            what, option=orjson.OPT_STRICT_INTEGER, default=self._default
-        ).decode()
+    def encode(
+        self, what: "Any", fallback: "Callable[[Any], Any] | None" = None, option=0
+    ) -> "str | list":
+        """
+        Serializes a message for the websocket. Messages carrying buffers are sent as
+        binary frames with the buffers attached as-is, everything else as text.
+        Objects orjson can't serialize are handed to `fallback`, if given.
+        """
+        buffers = []
+        start = time.perf_counter()
+        # browsers only support 53-bit integers, while Python supports 64-bit. ffids
+        # are sent as keys too (ie. in "pre" responses)
+        data = orjson.dumps(
+            what,
+            option=orjson.OPT_STRICT_INTEGER | orjson.OPT_NON_STR_KEYS | option,
+            default=lambda obj: self._default(obj, buffers, fallback),
+        )
+        metrics.encode.observe(time.perf_counter() - start)
+        if buffers:
+            return framing.pack(data, buffers)
+        return data.decode()
+
+    def decode(self, data: "str | bytes") -> "Any":
+        if isinstance(data, bytes):
+            # inflated, it's held to the same limit as any other message
+            return framing.unpack(data, self.websocket.max_size)
+        j = self.json_loads(data)
+        if j.get("c") != "shm":
+            return j
+        if self.shared is None:
+            raise ValueError("Got a shared frame, but shared memory isn't enabled")
+        return self.shared.get(j)
+
+    async def share(self, threshold: int | None):
+        """
+        Starts (or stops) handing frames of at least `threshold` bytes over through
+        shared memory, and lets the client know it can do the same.
+        """
+        if self.shared is not None:
+            self.shared.close()
+        self.shared = None if threshold is None else SharedFrames(threshold)
+        if self.shared is not None:
+            await self.queue(
+                {
+                    "c": "shared",
+                    "dir": self.shared.directory,
+                    "prefix": self.shared.incoming,
+                    "threshold": threshold,
+                }
+            )
 
     async def queue(self, what):
-        try:
-            data = self.json_dumps(what)
-            await self.websocket.send(data)
-        except Exception:
-            pass
+        """Encodes and sends a message. Anything that can't be encoded raises."""
+        await self.send(self.encode(what))
+
+    async def send(self, data: "str | list"):
+        """Queues an already encoded message, waiting if the queue is full."""
+        while self.queued >= self.high_water and not self.closed:
+            self.writable.clear()
+            await self.writable.wait()
+        if self.closed:
+            return
+
+        size = len(data) if isinstance(data, str) else sum(map(len, data))
+        self.outbox.append((data, size))
+        self.queued += size
+        self.wakeup.set()
+        if self.writer is None:
+            self.writer = asyncio.create_task(self._write())
+
+    def _next_frame(self) -> tuple["str | list", list, int]:
+        """Takes the next frame off the queue, along with its messages and size."""
+        entries = [self.outbox.popleft()]
+        data, size = entries[0]
+        if not isinstance(data, str):
+            return data, entries, size
+
+        while (
+            self.outbox
+            and isinstance(self.outbox[0][0], str)
+            and size + self.outbox[0][1] <= COALESCE_LIMIT
+        ):
+            entries.append(self.outbox.popleft())
+            size += entries[-1][1]
+        if len(entries) == 1:
+            return data, entries, size
+        return "[" + ",".join(data for data, _ in entries) + "]", entries, size
+
+    async def _write(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.outbox and self.websocket is not None:
+                frame, entries, size = self._next_frame()
+                wire, path = size, None
+                if self.shared is not None and size >= self.shared.threshold:
+                    path, frame = self.shared.put(frame, size)
+                elif (
+                    self.compress_threshold is not None
+                    and isinstance(frame, str)
+                    and size >= self.compress_threshold
+                ):
+                    frame = await self._compress(frame, size)
+                    wire = len(frame)
+                try:
+                    await self.websocket.send(frame)
+                    metrics.sent(wire, len(entries))
+                except ConnectionClosed as e:
+                    self._failed(e)
+                    if path is not None:
+                        self.shared.unlink(path)
+                    if self.resumable:
+                        # it's sent again once the client reconnects
+                        self.outbox.extendleft(reversed(entries))
+                        break
+                except Exception as e:
+                    self._failed(e)
+                    print(f"Mayflower couldn't send a message: {e!r}", file=sys.stderr)
+
+                self.queued -= size
+                if self.queued < self.high_water:
+                    self.writable.set()
+
+    async def _compress(self, frame: str, size: int) -> "str | bytes":
+        # zlib releases the GIL, so compressing big frames doesn't hold up the loop
+        compressed = await asyncio.to_thread(framing.compress, frame)
+        return compressed if len(compressed) < size else frame
+
+    def _failed(self, error: BaseException):
+        self.errors += 1
+        self.last_error = error
+        metrics.send_errors += 1
+
+    def stats(self) -> dict:
+        return {
+            "queued_messages": len(self.outbox),
+            "queued_bytes": self.queued,
+            "errors": self.errors,
+            "last_error": repr(self.last_error) if self.last_error else None,
+        }
+
+    def detach(self):
+        self.websocket = None
+
+    def attach(self, websocket):
+        self.websocket = websocket
+        self.wakeup.set()
+
+    def clear(self):
+        """Drops everything that hasn't been sent yet."""
+        self.outbox.clear()
+        self.queued = 0
+        self.writable.set()
+
+    def close(self):
+        self.closed = True
+        self.clear()
+        if self.shared is not None:
+            self.shared.close()
+        if self.writer is not None:
+            self.writer.cancel()
+
+
+def unreachable() -> socket.socket:
+    """A listening socket without an address."""
+    path = os.path.join(tempfile.gettempdir(), f"mayflower-{os.getpid()}.sock")
+    with suppress(FileNotFoundError):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX)
+    sock.bind(path)
+    os.unlink(path)
+    return sock
 
 
 class Interface:
-    async def run(self):
+    def __init__(
+        self,
+        max_concurrency: int = 64,
+        execution: str = "thread",
+        max_workers: int | None = None,
+        signatures: str = "bounded",
+        shutdown_on_close: bool = True,
+        single_connection: bool = False,
+        session_grace: float = 30.0,
+        metrics_port: int | None = None,
+        compress_threshold: int | None = COMPRESS_THRESHOLD,
+        shm_threshold: int | None = SHM_THRESHOLD,
+    ):
+        self.max_concurrency = max_concurrency
+        self.signatures = signatures
+        # whether a connection dropping takes the whole server down with it
+        self.shutdown_on_close = shutdown_on_close
+        # whether the server stops once its first connection ends, however it ends
+        # (ie. a template's fork)
+        self.single_connection = single_connection
+        # how long a session outlives its connection, waiting for the client to
+        # reconnect with its token
+        self.session_grace = session_grace
+        # where to serve metrics for Prometheus over plain HTTP, if anywhere
+        self.metrics_port = metrics_port
+        self.compress_threshold = compress_threshold
+        # frames at least this big go through shared memory, for clients that ask
+        self.shm_threshold = shm_threshold
+        self.sessions: dict[str, Session] = {}
+        self.connections = 0
+        # shared by every connection, since the pools are per-process anyways
+        self.pool = ExecutionPool(execution, max_workers)
+
+    async def run(
+        self,
+        socks: "list[socket.socket] | None" = None,
+        accepting: "Awaitable[socket.socket] | None" = None,
+    ):
+        """
+        Serves connections until interrupted. Workers pass in the sockets they share
+        with each other, rather than binding their own, and a template's forks wait on
+        `accepting` for the one connection they serve.
+        """
         self.loop = asyncio.get_running_loop()
         self.should_stop = self.loop.create_future()
         self.loop.add_signal_handler(signal.SIGTERM, self.should_stop.set_result, None)
         self.loop.add_signal_handler(signal.SIGINT, self.should_stop.set_result, None)
 
-        async with serve(self._on_message, "localhost", 8768, compression=None):
-            print("Mayflower listening on ws://localhost:8768")
+        standalone = socks is None and accepting is None
+        async with AsyncExitStack() as stack:
+            if standalone:
+                await stack.enter_async_context(
+                    serve(self._on_message, HOST, PORT, compression=None)
+                )
+                print(f"Mayflower listening on ws://{HOST}:{PORT}")
+            for sock in socks or ():
+                await stack.enter_async_context(
+                    serve(self._on_message, sock=sock, compression=None)
+                )
+            if accepting is not None:
+                # the connection still needs a server to belong to, so it gets one
+                # that listens where nobody can connect
+                server = await stack.enter_async_context(
+                    serve(self._on_message, sock=unreachable(), compression=None)
+                )
+                adopting = asyncio.ensure_future(self._adopt(server, accepting))
+                stack.callback(adopting.cancel)
+            if self.metrics_port is not None:
+                await stack.enter_async_context(
+                    await serve_metrics(HOST, self.metrics_port)
+                )
+
             await self.should_stop
-            print("Mayflower shutting down")
+            if standalone:
+                print("Mayflower shutting down")
+
+        self.pool.shutdown()
+
+    async def _adopt(self, server, accepting: "Awaitable[socket.socket]"):
+        sock = await accepting
+        await self.loop.connect_accepted_socket(
+            functools.partial(WebSocketServerProtocol, self._on_message, server), sock
+        )
 
     async def _on_message(self, websocket):
-        bridge = Bridge(IPC(websocket))
+        # clients that want to be able to resume connect with ?session=<token>, and
+        # &resume=1 when they're reconnecting with their state intact
+        query = parse_qs(urlsplit(websocket.path).query)
+        token = query.get("session", [None])[0]
+        resume = query.get("resume", ["0"])[0] == "1"
+        # clients on the same machine that can map shared memory connect with &shm=1
+        shared = query.get("shm", ["0"])[0] == "1"
 
-        try:
-            async for data in websocket:
-                if data[0] != "{":
-                    continue
+        session = self.sessions.get(token) if token else None
+        if session is not None and session.attached:
+            # the token is in use (ie. a duplicated tab), so this gets a session of
+            # its own that can't be resumed
+            session = token = None
 
-                j = bridge.ipc.json_loads(data)
-                await bridge.onMessage(
-                    j["r"], j["action"], j["ffid"], j["key"], j["val"]
-                )
+        if session is not None:
+            await session.attach(websocket, resume)
+            bridge = session.bridge
+        else:
+            bridge = Bridge(
+                IPC(
+                    websocket,
+                    resumable=token is not None,
+                    compress_threshold=self.compress_threshold,
+                ),
+                max_concurrency=self.max_concurrency,
+                pool=self.pool,
+                signatures=self.signatures,
+            )
+            if token:
+                session = self.sessions[token] = Session(token, bridge)
+
+        await bridge.ipc.share(self.shm_threshold if shared else None)
+
+        self.connections += 1
+        try:
+            await bridge.listen()
         except ConnectionClosed:
+            if session is None:
+                self._stop_on_close()
+        finally:
+            self.connections -= 1
+            if session is None:
+                bridge.close()
+            if self.single_connection:
+                self._stop_on_close()
+
+        if session is not None:
+            # a client that's done closes normally, anything else may be back
+            done = websocket.close_code == 1000 or self.single_connection
+            grace = 0 if done else self.session_grace
+            session.detach(grace, self._expire)
+
+    def _expire(self, session: Session):
+        if self.sessions.get(session.token) is session:
+            del self.sessions[session.token]
+        session.bridge.close()
+        if not self.sessions and not self.connections:
+            self._stop_on_close()
+
+    def _stop_on_close(self):
+        if self.shutdown_on_close and not self.should_stop.done():
             print("Connection closure caught for graceful shutdown...")
             self.should_stop.set_result(None)
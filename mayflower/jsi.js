@@ -33,12 +33,30 @@ function getType(obj) {
   if (typeof obj === "string") return "string";
 }
 
+// Rejects if `promise` hasn't settled within `ms`, so a call Python has already given
+// up on doesn't hold on to its result
+function within(promise, ms) {
+  let t;
+  const expired = new Promise((_, reject) => {
+    t = setTimeout(() => reject(new Error(`Timed out after ${ms}ms`)), ms);
+  });
+  return Promise.race([promise, expired]).finally(() => clearTimeout(t));
+}
+
 export class JSBridge {
   constructor(ipc, pyi) {
     // This is an ID that increments each time a new object is returned
     // to Python.
     this.ffid = 10000;
     this.pyi = pyi;
+    this.reset();
+    this.ipc = ipc;
+    this.eventMap = {};
+
+    // ipc.on('message', this.onMessage)
+  }
+
+  reset() {
     // This contains a refrence map of FFIDs to JS objects.
     this.m = {
       0: {
@@ -47,10 +65,6 @@ export class JSBridge {
         globalThis,
       },
     };
-    this.ipc = ipc;
-    this.eventMap = {};
-
-    // ipc.on('message', this.onMessage)
   }
 
   addWeakRef(object, ffid) {
@@ -65,31 +79,45 @@ export class JSBridge {
   async get(r, ffid, attr) {
     try {
       var v = await this.m[ffid][attr];
-      var type = v.ffid ? "py" : getType(v);
     } catch (e) {
       return this.ipc.send({ r, key: "void", val: this.ffid });
     }
+    return this.ipc.send({ r, ...this.describe(v) });
+  }
 
+  // How a value is sent to Python: primitives as-is, anything else by reference
+  describe(v) {
+    const type = v?.ffid ? "py" : getType(v);
     switch (type) {
       case "string":
-        return this.ipc.send({ r, key: "string", val: v });
+        return { key: "string", val: v };
       case "big":
-        return this.ipc.send({ r, key: "big", val: Number(v) });
+        return { key: "big", val: Number(v) };
       case "num":
-        return this.ipc.send({ r, key: "num", val: v });
+        return { key: "num", val: v };
       case "py":
-        return this.ipc.send({ r, key: "py", val: v.ffid });
+        return { key: "py", val: v.ffid };
       case "class":
-        this.m[++this.ffid] = v;
-        return this.ipc.send({ r, key: "class", val: this.ffid });
       case "fn":
-        this.m[++this.ffid] = v;
-        return this.ipc.send({ r, key: "fn", val: this.ffid });
       case "obj":
         this.m[++this.ffid] = v;
-        return this.ipc.send({ r, key: "obj", val: this.ffid });
+        return { key: type, val: this.ffid };
       default:
-        return this.ipc.send({ r, key: "void", val: this.ffid });
+        return { key: "void", val: this.ffid };
+    }
+  }
+
+  // Up to `n` items of an array-like starting at `start`, so Python can iterate
+  // it without a round trip per item
+  async slice(r, ffid, start, n) {
+    try {
+      const v = await this.m[ffid];
+      const end = Math.min(start + n, v.length);
+      const items = [];
+      for (let i = start; i < end; i++) items.push(this.describe(await v[i]));
+      return this.ipc.send({ r, key: "items", val: items });
+    } catch (e) {
+      return this.ipc.send({ r, key: "error", error: e.stack });
     }
   }
 
@@ -112,41 +140,18 @@ export class JSBridge {
   }
 
   // Call function with async keyword (also works with sync funcs)
-  async call(r, ffid, attr, args) {
+  async call(r, ffid, attr, args, d) {
     try {
       if (attr) {
-        var v = await this.m[ffid][attr].apply(this.m[ffid], args); // eslint-disable-line
+        var v = this.m[ffid][attr].apply(this.m[ffid], args); // eslint-disable-line
       } else {
-        var v = await this.m[ffid](...args); // eslint-disable-line
+        var v = this.m[ffid](...args); // eslint-disable-line
       }
+      v = await (d === undefined ? v : within(Promise.resolve(v), d));
     } catch (e) {
       return this.ipc.send({ r, key: "error", error: e.stack });
     }
-    const type = getType(v);
-    // console.log('GetType', type, v)
-    switch (type) {
-      case "string":
-        return this.ipc.send({ r, key: "string", val: v });
-      case "big":
-        return this.ipc.send({ r, key: "big", val: Number(v) });
-      case "num":
-        return this.ipc.send({ r, key: "num", val: v });
-      case "py":
-        return this.ipc.send({ r, key: "py", val: v.ffid });
-      case "class":
-        this.m[++this.ffid] = v;
-        return this.ipc.send({ r, key: "class", val: this.ffid });
-      case "fn":
-        // Fix for functions that return functions, use .call() wrapper
-        // this.m[++this.ffid] = { call: v }
-        this.m[++this.ffid] = v;
-        return this.ipc.send({ r, key: "fn", val: this.ffid });
-      case "obj":
-        this.m[++this.ffid] = v;
-        return this.ipc.send({ r, key: "obj", val: this.ffid });
-      default:
-        return this.ipc.send({ r, key: "void", val: this.ffid });
-    }
+    return this.ipc.send({ r, ...this.describe(v) });
   }
 
   // called for debug in JS, print() in python via __str__
@@ -195,13 +200,15 @@ export class JSBridge {
     parse(args);
   }
 
-  async onMessage({ r, action, p, ffid, key, args }) {
+  async onMessage({ r, action, p, ffid, key, args, f, d }) {
     debug("onMessage!", arguments, r, action);
+    // Python's garbage, piggybacking on this request
+    if (f) this.free(r, ffid, key, f);
     try {
       if (p) {
         this.process(r, args);
       }
-      await this[action](r, ffid, key, args);
+      await this[action](r, ffid, key, args, d);
     } catch (e) {
       return this.ipc.send({ r, key: "error", error: e.stack });
     }
@@ -0,0 +1,170 @@
+import collections
+import sys
+import time
+import weakref
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import TYPE_CHECKING
+
+import orjson
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any, Callable
+
+MEMO_ATTR = "__mayflower_memo__"
+MISSING = object()
+
+# every cache in the process, for reporting and invalidation
+memos: "weakref.WeakSet[Memo]" = weakref.WeakSet()
+
+
+class Memo:
+    """
+    An LRU cache of what a callable (or every function of a module) returned when JS
+    called it, keyed by the callable and its arguments. Only calls whose arguments
+    are plain JSON are cached; anything else, ie. objects passed by reference, is
+    always executed.
+
+    Entries expire after `ttl` seconds, if given, and the least recently used are
+    evicted beyond `maxsize` entries or roughly `max_bytes` of results.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int = 1024,
+        ttl: float | None = None,
+        max_bytes: int = 16 << 20,
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # key -> (result, expiry, size)
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = self.misses = self.skipped = 0
+        memos.add(self)
+
+    def key(self, fn: "Callable", args: list, kwargs: dict) -> "Any":
+        try:
+            key = (fn, orjson.dumps((args, kwargs), option=orjson.OPT_SORT_KEYS))
+            hash(key)
+        except TypeError:
+            self.skipped += 1
+            return None
+        return key
+
+    def get(self, key: "Any") -> "Any":
+        if (entry := self.entries.get(key)) is None:
+            self.misses += 1
+            return MISSING
+        value, expiry, _ = entry
+        if expiry is not None and expiry < time.monotonic():
+            self._drop(key)
+            self.misses += 1
+            return MISSING
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: "Any", value: "Any"):
+        size = len(key[1]) + sizeof(value)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._drop(key)
+        expiry = None if self.ttl is None else time.monotonic() + self.ttl
+        self.entries[key] = (value, expiry, size)
+        self.bytes += size
+        while len(self.entries) > self.maxsize or self.bytes > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+
+    def _drop(self, key: "Any"):
+        self.bytes -= self.entries.pop(key)[2]
+
+    def invalidate(self, fn: "Callable | None" = None):
+        if fn is None:
+            self.entries.clear()
+            self.bytes = 0
+            return
+        targets = [
+            key for key in self.entries if getattr(key[0], "__func__", key[0]) is fn
+        ]
+        for key in targets:
+            self._drop(key)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+        }
+
+
+def sizeof(value: "Any") -> int:
+    # good enough for the primitives that make up most results. containers are only
+    # counted shallowly
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+def memoize(
+    target: "Any" = None,
+    *,
+    maxsize: int = 1024,
+    ttl: float | None = None,
+    max_bytes: int = 16 << 20,
+):
+    """
+    Marks a function, or every function defined in a module, as pure: JS calling it
+    again with the same (JSON) arguments gets the earlier result without it running.
+    Mutable results are shared between the calls. Usable as a decorator, bare or
+    with options, or called on a module (ie. `memoize(sys.modules[__name__])`).
+    """
+
+    def mark(target):
+        if isinstance(target, ModuleType):
+            name = target.__name__
+        else:
+            name = f"{target.__module__}.{target.__qualname__}"
+        setattr(target, MEMO_ATTR, Memo(name, maxsize, ttl, max_bytes))
+        return target
+
+    return mark(target) if target is not None else mark
+
+
+def memo_for(fn: "Any") -> Memo | None:
+    if not memos:
+        return None
+    if isinstance(fn, MethodType):
+        fn = fn.__func__
+    # anything else may well not be pure, or even answer attribute lookups itself
+    if not isinstance(fn, (FunctionType, BuiltinFunctionType)):
+        return None
+    if (memo := getattr(fn, MEMO_ATTR, None)) is not None:
+        return memo
+    module = sys.modules.get(fn.__module__ or "")
+    return getattr(module, MEMO_ATTR, None) if module is not None else None
+
+
+def stats() -> dict:
+    return {memo.name: memo.stats() for memo in memos}
+
+
+def invalidate(target: "Any" = None):
+    """
+    Forgets cached results: of `target`, a memoized function or module, or of
+    everything if not given.
+    """
+    if target is None:
+        for memo in memos:
+            memo.invalidate()
+    elif isinstance(target, ModuleType):
+        if (memo := getattr(target, MEMO_ATTR, None)) is not None:
+            memo.invalidate()
+    elif (memo := memo_for(target)) is not None:
+        # bound methods are cached separately, but forgotten together
+        memo.invalidate(getattr(target, "__func__", target))
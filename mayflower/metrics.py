@@ -0,0 +1,237 @@
+import asyncio
+import bisect
+import contextlib
+import time
+import traceback
+import weakref
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any, Callable
+
+    from .bridge import Bridge
+
+    Profiler = Callable[[Any, float, BaseException | None], None]
+
+# upper bounds of the latency histograms, in seconds
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def escape(label: str) -> str:
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    def __init__(self):
+        # the last count is everything over the largest bucket
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        total, out = 0, []
+        for bound, n in zip(BUCKETS, self.counts, strict=False):
+            total += n
+            out.append((repr(bound), total))
+        out.append(("+Inf", self.count))
+        return out
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "seconds": round(self.sum, 6),
+            "buckets": dict(self.cumulative()),
+        }
+
+
+class Metrics:
+    """
+    Counters for everything going through the bridges of this process. They're only
+    ever touched from the event loop, except by calls offloaded to threads, where a
+    lost update now and then is an acceptable price for not locking.
+    """
+
+    def __init__(self):
+        self.actions: dict[str, Histogram] = {}
+        self.errors: dict[str, int] = {}
+        self.encode = Histogram()
+        self.bytes_in = self.bytes_out = 0
+        self.messages_in = self.messages_out = 0
+        self.frees_in = self.frees_out = 0
+        self.send_errors = 0
+        self.timeouts = self.cancelled = 0
+        self.bridges: "weakref.WeakSet[Bridge]" = weakref.WeakSet()
+        self.profilers: "list[Profiler]" = []
+
+    def track(self, bridge: "Bridge"):
+        self.bridges.add(bridge)
+
+    def request(self, action: str, seconds: float, failed: bool):
+        if (histogram := self.actions.get(action)) is None:
+            histogram = self.actions[action] = Histogram()
+        histogram.observe(seconds)
+        if failed:
+            self.errors[action] = self.errors.get(action, 0) + 1
+
+    def received(self, size: int):
+        self.messages_in += 1
+        self.bytes_in += size
+
+    def sent(self, size: int, messages: int = 1):
+        self.messages_out += messages
+        self.bytes_out += size
+
+    def gauges(self) -> dict:
+        bridges = list(self.bridges)
+        return {
+            "connections": len(bridges),
+            "pending_requests": sum(len(b.dispatcher.tasks) for b in bridges),
+            "pending_js_calls": sum(len(b.executor.pending) for b in bridges),
+            "queued_frees": sum(len(b.executor.freeable) for b in bridges),
+            "outbound_queue": sum(len(b.ipc.outbox) for b in bridges),
+            "outbound_bytes": sum(b.ipc.queued for b in bridges),
+            "live_handles": sum(len(b.m) for b in bridges),
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "actions": {
+                action: {**h.snapshot(), "errors": self.errors.get(action, 0)}
+                for action, h in self.actions.items()
+            },
+            "encode": self.encode.snapshot(),
+            "bytes": {"in": self.bytes_in, "out": self.bytes_out},
+            "messages": {"in": self.messages_in, "out": self.messages_out},
+            "frees": {"in": self.frees_in, "out": self.frees_out},
+            "send_errors": self.send_errors,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            **self.gauges(),
+        }
+
+    def prometheus(self) -> str:
+        """Renders everything in Prometheus' text exposition format."""
+        lines = []
+
+        def metric(name, kind, help):
+            lines.append(f"# HELP mayflower_{name} {help}")
+            lines.append(f"# TYPE mayflower_{name} {kind}")
+
+        def histogram(name, h, labels=""):
+            for bound, n in h.cumulative():
+                sep = "," if labels else ""
+                lines.append(
+                    f'mayflower_{name}_bucket{{{labels}{sep}le="{bound}"}} {n}'
+                )
+            lines.append(f"mayflower_{name}_sum{{{labels}}} {h.sum}")
+            lines.append(f"mayflower_{name}_count{{{labels}}} {h.count}")
+
+        metric("request_seconds", "histogram", "Time taken to handle requests from JS")
+        for action, h in self.actions.items():
+            histogram("request_seconds", h, f'action="{escape(action)}"')
+        metric("request_errors_total", "counter", "Requests from JS that failed")
+        for action, n in self.errors.items():
+            labels = f'action="{escape(action)}"'
+            lines.append(f"mayflower_request_errors_total{{{labels}}} {n}")
+        metric("encode_seconds", "histogram", "Time taken to serialize messages")
+        histogram("encode_seconds", self.encode)
+
+        for name, help, value in (
+            ("received_bytes_total", "Bytes received from JS", self.bytes_in),
+            ("sent_bytes_total", "Bytes sent to JS", self.bytes_out),
+            ("received_messages_total", "Messages received", self.messages_in),
+            ("sent_messages_total", "Messages sent", self.messages_out),
+            ("received_frees_total", "Handles JS freed", self.frees_in),
+            ("sent_frees_total", "Proxies freed on the JS side", self.frees_out),
+            ("send_errors_total", "Messages that couldn't be sent", self.send_errors),
+            ("timeouts_total", "Requests from JS past their deadline", self.timeouts),
+            ("cancelled_total", "Requests JS cancelled", self.cancelled),
+        ):
+            metric(name, "counter", help)
+            lines.append(f"mayflower_{name} {value}")
+        for name, value in self.gauges().items():
+            metric(name, "gauge", name.replace("_", " ").capitalize())
+            lines.append(f"mayflower_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def profile(self, fn: "Any"):
+        """Times a call made on behalf of JS, if any profilers want to know."""
+        if not self.profilers:
+            return contextlib.nullcontext()
+        return self._profile(fn)
+
+    @contextlib.contextmanager
+    def _profile(self, fn: "Any"):
+        error = None
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            for profiler in self.profilers:
+                try:
+                    profiler(fn, elapsed, error)
+                except Exception:
+                    traceback.print_exc()
+
+
+# shared by every connection in the process
+metrics = Metrics()
+
+
+def add_profiler(profiler: "Profiler") -> "Callable[[], None]":
+    """
+    Calls `profiler(fn, seconds, error)` after every Python callable JS invokes, so
+    slow calls can be attributed. Returns a function that removes it again.
+    """
+    metrics.profilers.append(profiler)
+    return lambda: metrics.profilers.remove(profiler)
+
+
+async def serve(host: str, port: int) -> asyncio.Server:
+    """Serves the metrics over plain HTTP, for Prometheus to scrape."""
+
+    async def respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # whatever was asked for, the answer is the same
+            while (await reader.readline()).strip():
+                pass
+            body = metrics.prometheus().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                b"Connection: close\r\n\r\n" + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(respond, host, port)
@@ -1,75 +1,197 @@
 import asyncio
-import json
+import collections
+import concurrent.futures
+import itertools
 import sys
+import time
 
-from mayflower.aio import run_from_sync
+import orjson
+
+from mayflower.aio import on_loop, wait_sync
+from mayflower.dispatch import current_deadline
+from mayflower.metrics import metrics
 
 
 class JavaScriptError(Exception):
     pass
 
 
+class JavaScriptTimeout(JavaScriptError, TimeoutError):
+    pass
+
+
+# collected proxies are freed on the JS side in bulk: as soon as this many are waiting,
+# after this many seconds, or along with the next request to JS, whichever is first
+FREE_BATCH = 512
+FREE_DELAY = 0.1
+
+# orjson would serialize these by value, but JS gets them by reference like any other
+# Python object
+PASSTHROUGH = orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
 # This is the Executor, something that sits in the middle of the Bridge and is the interface for
 # Python to JavaScript. This is also used by the bridge to call Python from Node.js.
 class Executor:
     def __init__(self, bridge):
         self.bridge = bridge
-        self.i = 0
+        # Python may call into JS from worker threads too, so request ids have to be
+        # handed out atomically
+        self.ids = itertools.count(1)
+        # request id -> future for JS' response, resolved by the connection's reader
+        self.pending = {}
+        # ffids of collected proxies not yet freed on the JS side. proxies can be
+        # collected on any thread, and deques are safe to share between them
+        self.freeable = collections.deque()
+        # whether a flush is on its way, and whether it's one for a full batch
+        self.flush_scheduled = self.flush_now = False
+
+    def send(self, make):
+        """
+        Schedules a send on the event loop. `make` builds the coroutine doing the
+        sending, and is only called once on the loop.
+        """
+        if on_loop(self.bridge.loop):
+            asyncio.create_task(make())
+        else:
+            # called from a worker thread (or the GC)
+            self.bridge.loop.call_soon_threadsafe(lambda: asyncio.create_task(make()))
+
+    def queue(self, r, payload):
+        self.send(lambda: self.send_request(r, payload))
 
-    def queue(self, *args, **kwargs):
-        asyncio.create_task(self.bridge.queue_request(*args, **kwargs))
+    async def send_request(self, r, payload):
+        # whoever's waiting on the response would never get one
+        try:
+            await self.bridge.queue_request(r, payload)
+        except Exception as e:
+            self.reject(r, e)
 
-    def ipc(self, action, ffid, attr, args=None):
-        self.i += 1
-        r = self.i  # unique request ts, acts as ID for response
+    def resolve(self, j):
+        if (response := self.pending.pop(j["r"], None)) and not response.done():
+            response.set_result(j)
+
+    def reject(self, r, error):
+        if (response := self.pending.pop(r, None)) and not response.done():
+            response.set_exception(error)
+
+    def close(self):
+        for response in self.pending.values():
+            response.cancel()
+        self.pending.clear()
+        self.freeable.clear()
+
+    def budget(self, timeout):
+        """
+        How long a call into JS may take, in seconds: `timeout`, cut short by the
+        deadline of the request we're running on behalf of, if any.
+        """
+        if (deadline := current_deadline.get()) is None:
+            return timeout
+        remaining = deadline - time.monotonic()
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def ipc(self, action, ffid, attr, args=None, timeout=None):
+        if on_loop(self.bridge.loop):
+            # JS' answer is read on the loop, which would be stuck waiting for it
+            raise RuntimeError(
+                "Can't wait on JS from the event loop. Call into JS from callables run "
+                "with the thread policy, or from coroutines through `asyncio.to_thread`"
+            )
+
+        r = next(self.ids)  # unique request ts, acts as ID for response
         if action == "get":  # return obj[prop]
-            self.queue(r, {"r": r, "action": "get", "ffid": ffid, "key": attr})
+            payload = {"r": r, "action": "get", "ffid": ffid, "key": attr}
         if action == "init":  # return new obj[prop]
-            self.queue(
-                r, {"r": r, "action": "init", "ffid": ffid, "key": attr, "args": args}
-            )
+            payload = {
+                "r": r,
+                "action": "init",
+                "ffid": ffid,
+                "key": attr,
+                "args": args,
+            }
         if action == "inspect":  # return require('util').inspect(obj[prop])
-            self.queue(r, {"r": r, "action": "inspect", "ffid": ffid, "key": attr})
+            payload = {"r": r, "action": "inspect", "ffid": ffid, "key": attr}
         if action == "serialize":  # return JSON.stringify(obj[prop])
-            self.queue(r, {"r": r, "action": "serialize", "ffid": ffid})
+            payload = {"r": r, "action": "serialize", "ffid": ffid}
         if action == "keys":
-            self.queue(r, {"r": r, "action": "keys", "ffid": ffid})
+            payload = {"r": r, "action": "keys", "ffid": ffid}
+        if action == "slice":  # return obj.slice(prop, prop + args)
+            payload = {"r": r, "action": "slice", "ffid": ffid, "key": attr}
+            payload["args"] = args
         if action == "raw":
             # (not really a FFID, but request ID)
             r = ffid
-            asyncio.create_task(self.bridge.queue_request_raw(ffid, args))
-
-        # Listen for a response
-        while True:
-            j = run_from_sync(self.bridge.read())
-            if j["r"] == r:  # if this is a message for us, OK, return to Python calls
-                break
-            else:  # The JS API we called wants to call a Python API... so let the bridge handle it.
-                asyncio.create_task(
-                    self.bridge.onMessage(
-                        j["r"], j["action"], j["ffid"], j["key"], j["val"]
-                    )
-                )
+            payload = args
+
+        if (timeout := self.budget(timeout)) is not None:
+            if timeout <= 0:
+                raise JavaScriptTimeout(f"No time left to access '{attr}'")
+            # so JS can stop waiting on its end too
+            payload["d"] = int(timeout * 1000)
+
+        # The connection's reader hands JS' response straight to this future, which it
+        # can resolve without bouncing back through the loop.
+        response = concurrent.futures.Future()
+        self.pending[r] = response
+
+        # Any calls JS makes back into Python while we wait are dispatched by the
+        # reader as usual, so let it know not to make them wait on us.
+        with self.bridge.dispatcher.park(), self.bridge.pool.block():
+            if action == "raw":
+                # serialized on the loop, so FFIDs are only ever assigned there
+                self.send(lambda: self.send_raw(r, payload))
+            else:
+                self.queue(r, self.piggyback(payload))
+            try:
+                j = wait_sync(response, timeout)
+            except TimeoutError:
+                # JS' answer, if it ever comes, goes nowhere
+                self.pending.pop(r, None)
+                raise JavaScriptTimeout(
+                    f"JS didn't respond to '{attr}' within {timeout:.3g}s"
+                ) from None
 
         if "error" in j:
             raise JavaScriptError(f"Access to '{attr}' failed:\n{j['error']}\n")
 
         return j
 
-    def pcall(self, ffid, action, attr, args, timeout: int | None = 10):
+    async def send_raw(self, r, packet):
+        try:
+            data = self.serialize(self.piggyback(packet))
+        except Exception as e:
+            self.reject(r, e)
+            return
+        await self.bridge.queue_request_raw(r, data)
+
+    def serialize(self, packet):
+        """
+        Encodes a packet for JS in a single pass. Proxies are sent as their ffid, and
+        anything else that isn't plain data gets a new one.
+        """
+        return self.bridge.ipc.encode(packet, self.ser, PASSTHROUGH)
+
+    def ser(self, arg):
+        if hasattr(arg, "ffid"):
+            return {"ffid": arg.ffid}
+        else:
+            # Anything we don't know how to serialize -- exotic or not -- treat it as an object
+            return {"ffid": self.new_ffid(arg)}
+
+    def pcall(self, ffid, action, attr, args, timeout: float | None = None):
         """
         This function does a one-pass call to JavaScript. Since we assign the FFIDs, we do not
         need to send any preliminary call to JS. We can assign them ourselves.
 
         We simply iterate over the arguments, and for each of the non-primitive values, we
         create new FFIDs for them, then use them as a replacement for the non-primitive arg
-        objects. We can then send the request to JS and expect one response back.
+        objects. We can then send the request to JS and expect one response back. The
+        packet is serialized on the event loop, so FFIDs are only ever assigned there.
         """
-        self.ctr = 0
-        self.i += 1
-        requestId = self.i
+        requestId = next(self.ids)
         packet = {
-            "r": self.i,
+            "r": requestId,
             "c": "jsi",
             "p": 1,
             "action": action,
@@ -78,16 +200,7 @@ class Executor:
             "args": args,
         }
 
-        def ser(arg):
-            if hasattr(arg, "ffid"):
-                return {"ffid": arg.ffid}
-            else:
-                # Anything we don't know how to serialize -- exotic or not -- treat it as an object
-                return {"ffid": self.new_ffid(arg)}
-
-        payload = json.dumps(packet, default=ser)
-
-        res = self.ipc("raw", requestId, attr, payload)
+        res = self.ipc("raw", requestId, attr, packet, timeout)
 
         return res["key"], res["val"]
 
@@ -103,8 +216,8 @@ class Executor:
         resp = self.pcall(ffid, "call", method, args, timeout)
         return resp
 
-    def initProp(self, ffid, method, args):
-        resp = self.pcall(ffid, "init", method, args)
+    def initProp(self, ffid, method, args, timeout=None):
+        resp = self.pcall(ffid, "init", method, args, timeout)
         return resp
 
     def inspect(self, ffid, mode):
@@ -114,23 +227,79 @@ class Executor:
     def keys(self, ffid):
         return (self.ipc("keys", ffid, ""))["keys"]
 
+    def slice(self, ffid, start, n):
+        return [(i["key"], i["val"]) for i in self.ipc("slice", ffid, start, n)["val"]]
+
     def free(self, ffid):
-        self.i += 1
+        self.freeable.append(ffid)
+        if len(self.freeable) < FREE_BATCH:
+            if self.flush_scheduled:
+                return
+            delay = FREE_DELAY
+        elif self.flush_now:
+            return
+        else:
+            self.flush_now, delay = True, 0
+
+        self.flush_scheduled = True
         try:
-            self.queue(self.i, {"r": self.i, "action": "free", "args": [ffid]})
-        except ValueError:  # Event loop is dead, no need for GC
+            # called from __del__, which may well be on another thread
+            self.bridge.loop.call_soon_threadsafe(
+                self.bridge.loop.call_later, delay, self.flush
+            )
+        except RuntimeError:  # Event loop is dead, no need for GC
             pass
 
+    def take_freeable(self):
+        # proxies are freed, and requests sent, from any thread, so someone else may
+        # be draining it at the same time
+        ffids = []
+        while True:
+            try:
+                ffids.append(self.freeable.popleft())
+            except IndexError:
+                break
+        metrics.frees_out += len(ffids)
+        return ffids
+
+    def piggyback(self, payload):
+        """Attaches any pending frees to a request that's about to go out to JS."""
+        if ffids := self.take_freeable():
+            payload["f"] = ffids
+        return payload
+
+    def flush(self):
+        self.flush_scheduled = self.flush_now = False
+        if ffids := self.take_freeable():
+            r = next(self.ids)
+            self.queue(r, {"r": r, "action": "free", "args": ffids})
+
     def new_ffid(self, for_object):
-        self.bridge.cur_ffid += 1
-        self.bridge.m[self.bridge.cur_ffid] = for_object
-        return self.bridge.cur_ffid
+        return self.bridge.m.add(for_object)
 
     def get(self, ffid):
         return self.bridge.m[ffid]
 
 
-INTERNAL_VARS = ["ffid", "_ix", "_exe", "_pffid", "_pname", "_es6", "~class", "_Keys"]
+INTERNAL_VARS = [
+    "ffid",
+    "_ix",
+    "_exe",
+    "_pffid",
+    "_pname",
+    "_es6",
+    "~class",
+    "_Keys",
+    "_Len",
+    "_Chunk",
+]
+
+# JS arrays are fetched in chunks while iterating, starting small so short loops (or
+# ones that break early) don't pay for items they never see
+MIN_CHUNK = 16
+MAX_CHUNK = 1024
+# the kinds of item JS hands out a new ffid for
+BY_REFERENCE = ("fn", "class", "obj")
 
 
 # "Proxy" classes get individually instantiated for every thread and JS object
@@ -145,6 +314,8 @@ class Proxy(object):
         self._pname = prop_name
         self._es6 = es6
         self._Keys = None
+        self._Len = None
+        self._Chunk = None
 
     def _call(self, method, methodType, val):
         # this = self
@@ -167,7 +338,7 @@ class Proxy(object):
 
     def __call__(self, *args, timeout=10):
         mT, v = (
-            self._exe.initProp(self._pffid, self._pname, args)
+            self._exe.initProp(self._pffid, self._pname, args, timeout)
             if self._es6
             else self._exe.callProp(self._pffid, self._pname, args, timeout)
         )
@@ -191,8 +362,11 @@ class Proxy(object):
         return self._call(attr, methodType, val)
 
     def __iter__(self):
+        self._drop_chunk()
         self._ix = 0
-        if self.length is None:
+        self._Len = self.length
+        self._Chunk = collections.deque()
+        if self._Len is None:
             self._Keys = self._exe.keys(self.ffid)
         return self
 
@@ -204,13 +378,28 @@ class Proxy(object):
                 return result
             else:
                 raise StopIteration
-        elif self._ix < self.length:
-            result = self[self._ix]
+        elif self._ix < self._Len:
+            if not self._Chunk:
+                # each chunk is twice the size of the last, short of the length we
+                # started out with
+                n = min(max(self._ix, MIN_CHUNK), MAX_CHUNK, self._Len - self._ix)
+                self._Chunk.extend(self._exe.slice(self.ffid, self._ix, n))
+                if not self._Chunk:  # it shrank while we were iterating
+                    raise StopIteration
+            result = self._call(self._ix, *self._Chunk.popleft())
             self._ix += 1
             return result
         else:
             raise StopIteration
 
+    def _drop_chunk(self):
+        # the items left over were never wrapped in a proxy, which would free them
+        if self._Chunk:
+            for kind, val in self._Chunk:
+                if kind in BY_REFERENCE:
+                    self._exe.free(val)
+            self._Chunk.clear()
+
     def __setattr__(self, name, value):
         if name in INTERNAL_VARS:
             object.__setattr__(self, name, value)
@@ -238,4 +427,5 @@ class Proxy(object):
 
     def __del__(self):
         if not sys.is_finalizing():
+            self._drop_chunk()
             self._exe.free(self.ffid)
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+from operator import attrgetter, itemgetter
+from types import ModuleType
+from typing import TYPE_CHECKING
+
+from .imports import submodule
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any, Callable
+
+    Steps = tuple[tuple[type, Callable[[Any], Any]], ...]
+
+MISSING = object()
+CONTAINERS = (dict, tuple, list)
+
+
+def fix_key(key):
+    return key.replace("~~", "") if isinstance(key, str) else key
+
+
+def getattr_step(name: str) -> "Callable[[Any], Any]":
+    # attrgetter would treat dots as a path
+    return attrgetter(name) if "." not in name else lambda v: getattr(v, name)
+
+
+def attribute(v: "Any", name: str) -> "Any":
+    if (attr := getattr(v, name, MISSING)) is MISSING and isinstance(v, ModuleType):
+        # packages don't always import their submodules, so `pkg.sub` imports it on
+        # demand rather than us having to import everything up front
+        if (module := submodule(v, name)) is not None:
+            return module
+    return attr
+
+
+def walk(v: "Any", keys: list, invoke: bool) -> tuple["Any", "Steps"]:
+    """
+    Resolves `keys` on `v`, returning the result along with the steps it took to get
+    there so they can be replayed without probing.
+
+    Since in Python, items ([]) and attributes (.) function differently, when calling
+    we want to try . first, then [] (ie. with the .append function we don't want
+    ['append'] taking precedence in a dict). However if we're only getting objects, we
+    can first try bracket for dicts, then attributes.
+    """
+    steps = []
+    for key in keys:
+        kind = type(v)
+        if not invoke and isinstance(v, CONTAINERS):
+            step = itemgetter(key)
+        elif (attr := attribute(v, str(key))) is not MISSING:
+            steps.append((kind, getattr_step(str(key))))
+            v = attr
+            continue
+        elif hasattr(v, "__getitem__"):
+            step = itemgetter(key)
+        else:
+            raise LookupError(f"Property '{fix_key(key)}' does not exist on {v!r}")
+
+        try:
+            v = step(v)
+        except Exception as e:
+            raise LookupError(
+                f"Property '{fix_key(key)}' does not exist on {v!r}"
+            ) from e
+        steps.append((kind, step))
+
+    return v, tuple(steps)
+
+
+class Stale(Exception):
+    """Raised when a cached path stops applying at `index`, having resolved `value`."""
+
+    def __init__(self, index: int, value: "Any"):
+        super().__init__(index)
+        self.index = index
+        self.value = value
+
+
+def replay(v: "Any", steps: "Steps") -> "Any":
+    for i, (kind, step) in enumerate(steps):
+        if type(v) is not kind:
+            raise Stale(i, v)
+        try:
+            v = step(v)
+        except (LookupError, AttributeError) as e:
+            raise Stale(i, v) from e
+    return v
+
+
+class PathCache:
+    """
+    An LRU cache of resolved attribute paths, keyed by `(ffid, keys, invoke)`. Entries
+    hold the accessors a previous resolution used rather than its result, so mutable
+    objects are always read fresh; each step is guarded by the type it was compiled
+    against, and a path that's gone stale is resolved afresh from wherever it stopped
+    applying, so no getter along it runs twice.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.entries: OrderedDict[tuple, "Steps"] = OrderedDict()
+        self.by_ffid: dict[int, set[tuple]] = {}
+
+    def resolve(self, root: "Any", ffid: int, keys: list, invoke: bool) -> "Any":
+        if not keys:
+            return root
+        try:
+            path = (ffid, tuple(keys), invoke)
+            steps = self.entries.get(path)
+        except TypeError:  # unhashable keys aren't worth caching
+            return walk(root, keys, invoke)[0]
+
+        if steps is None:
+            v, steps = walk(root, keys, invoke)
+        else:
+            try:
+                v = replay(root, steps)
+                self.entries.move_to_end(path)
+                return v
+            except Stale as stale:
+                self._drop(path)
+                v, rest = walk(stale.value, keys[stale.index :], invoke)
+                steps = steps[: stale.index] + rest
+            except BaseException:
+                self._drop(path)
+                raise
+
+        self.entries[path] = steps
+        self.by_ffid.setdefault(ffid, set()).add(path)
+        if len(self.entries) > self.maxsize:
+            self._drop(next(iter(self.entries)))
+        return v
+
+    def invalidate(self, ffid: int):
+        for path in self.by_ffid.pop(ffid, ()):
+            del self.entries[path]
+
+    def _drop(self, path: tuple):
+        del self.entries[path]
+        if paths := self.by_ffid.get(path[0]):
+            paths.discard(path)
+            if not paths:
+                del self.by_ffid[path[0]]
@@ -0,0 +1,41 @@
+import asyncio
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Callable
+
+    from .bridge import Bridge
+
+
+class Session:
+    """
+    A bridge that outlives its connection. When the client reconnects with the same
+    token within the grace period it picks up the bridge, and everything it holds,
+    where it left off; otherwise the session expires and the bridge is closed.
+    """
+
+    def __init__(self, token: str, bridge: "Bridge"):
+        self.token = token
+        self.bridge = bridge
+        self.attached = True
+        self.expiry: asyncio.TimerHandle | None = None
+
+    async def attach(self, websocket, resume: bool):
+        if self.expiry is not None:
+            self.expiry.cancel()
+            self.expiry = None
+        self.attached = True
+        if not resume:
+            # a new JS context (ie. a reloaded page) took over the session. none of
+            # the references the old one held can be used anymore
+            self.bridge.reset()
+        self.bridge.ipc.attach(websocket)
+
+    def detach(self, grace: float, expire: "Callable[[Session], None]"):
+        self.attached = False
+        self.bridge.ipc.detach()
+        if grace <= 0:
+            expire(self)
+        else:
+            loop = asyncio.get_running_loop()
+            self.expiry = loop.call_later(grace, expire, self)
@@ -0,0 +1,103 @@
+import itertools
+import mmap
+import os
+import secrets
+import tempfile
+from typing import TYPE_CHECKING
+
+import orjson
+
+from . import framing
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any
+
+# tmpfs on Linux, so "files" there never touch a disk
+DIRECTORY = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+PREFIX = "mayflower-"
+
+
+class SharedFrames:
+    """
+    Hands frames of at least `threshold` bytes over through shared memory rather than
+    the websocket, for clients on the same machine. Each frame is written to a file of
+    its own, mapped by whoever reads it, and the socket only carries its descriptor:
+
+        {"c": "shm", "path": path, "kind": TEXT or BINARY, "size": bytes}
+
+    Readers unlink the file once they've mapped it. Anything left over when the
+    connection closes (ie. frames the client never got to) is unlinked then. Frames
+    from the client have to be named with `incoming`, which only it is told, so
+    nobody can point us at files of another connection's.
+    """
+
+    def __init__(self, threshold: int, directory: str = DIRECTORY):
+        self.threshold = threshold
+        self.directory = directory
+        self.ids = itertools.count()
+        self.prefix = os.path.join(directory, f"{PREFIX}{os.getpid()}-{id(self):x}-")
+        # files written but not necessarily read yet
+        self.outstanding: set[str] = set()
+        self.incoming = f"{PREFIX}js-{secrets.token_hex(16)}-"
+
+    def put(self, frame: "str | list", size: int) -> tuple[str, str]:
+        """Writes a frame out, returning its path and the descriptor to send instead."""
+        if isinstance(frame, str):
+            kind, fragments = framing.TEXT, [frame.encode()]
+            size = len(fragments[0])
+        else:
+            kind, fragments = framing.BINARY, frame
+
+        path = f"{self.prefix}{next(self.ids)}"
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            os.ftruncate(fd, size)
+            with mmap.mmap(fd, size) as m:
+                offset = 0
+                for fragment in fragments:
+                    m[offset : offset + len(fragment)] = fragment
+                    offset += len(fragment)
+        except BaseException:
+            os.unlink(path)
+            raise
+        finally:
+            os.close(fd)
+
+        if len(self.outstanding) >= 256:
+            # most have been read (and unlinked) by now
+            self.outstanding = {p for p in self.outstanding if os.path.exists(p)}
+        self.outstanding.add(path)
+        descriptor = {"c": "shm", "path": path, "kind": kind, "size": size}
+        return path, orjson.dumps(descriptor).decode()
+
+    def get(self, j: dict) -> "Any":
+        """Maps the frame a descriptor from the client points to, and parses it."""
+        path = j["path"]
+        name = os.path.basename(path)
+        ours = os.path.dirname(path) == self.directory
+        if not ours or not name.startswith(self.incoming):
+            raise ValueError(f"Not a shared frame: '{path}'")
+
+        # nor through a link to anywhere else
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+        try:
+            os.unlink(path)
+            data = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        if j["kind"] == framing.TEXT:
+            with data, memoryview(data) as view:
+                return orjson.loads(view)
+        # attachments stay views into the mapping, which lives as long as they do
+        return framing.unpack(data)
+
+    def unlink(self, path: str):
+        self.outstanding.discard(path)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        for path in list(self.outstanding):
+            self.unlink(path)
@@ -0,0 +1,82 @@
+import reprlib
+from collections import deque
+from typing import TYPE_CHECKING
+
+from .proxy import Proxy
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any
+
+# how much of an object's repr is shipped along with its handle:
+#   eager:   the full repr, however long it takes to build
+#   bounded: a cheap summary, truncated to a fixed length
+#   lazy:    nothing, JS asks for the repr (`await obj.toString()`) when it wants it
+SIGNATURE_MODES = ("eager", "bounded", "lazy")
+
+# containers holding more than this many items are summarized by their size alone
+MAX_ITEMS = 16
+MAX_LENGTH = 200
+SIZED = (list, tuple, dict, set, frozenset, deque)
+
+
+class BoundedRepr(reprlib.Repr):
+    def __init__(self):
+        super().__init__()
+        self.maxlevel = 3
+        self.maxtuple = self.maxlist = self.maxarray = self.maxdeque = MAX_ITEMS
+        self.maxdict = self.maxset = self.maxfrozenset = MAX_ITEMS
+        self.maxstring = 80
+        self.maxlong = 40
+        self.maxother = MAX_LENGTH
+
+    def repr_instance(self, x: "Any", level: int) -> str:
+        # reprlib only cuts the repr short once it's been built, and a __repr__ written
+        # in Python may take as long as it likes (ie. a DataFrame's prints every row).
+        # only the builtin ones are cheap enough to call
+        if not hasattr(type(x).__repr__, "__objclass__"):
+            return f"<{type(x).__module__}.{type(x).__qualname__} object>"
+        return super().repr_instance(x, level)
+
+    def repr_bytes(self, x: "Any", level: int) -> str:
+        if len(x) <= self.maxstring:
+            return repr(x)
+        return repr(x[: self.maxstring]) + "..."
+
+    repr_bytearray = repr_bytes
+
+
+bounded_repr = BoundedRepr().repr
+
+
+def summarize(what: "Any") -> str | None:
+    """
+    Describes large containers and array-likes by their type and size, ie.
+    `list[len=1000000]` or `ndarray[shape=(1000, 1000), dtype=float64]`, without
+    looking at their contents. Returns None for anything else.
+    """
+    kind = type(what).__name__
+    if isinstance(what, SIZED):
+        return f"{kind}[len={len(what)}]" if len(what) > MAX_ITEMS else None
+
+    # only trust attributes defined on the class, so nothing with a __getattr__ (ie. a
+    # proxy to JS) gets probed
+    shape = getattr(what, "shape", None) if hasattr(type(what), "shape") else None
+    if not isinstance(shape, tuple):
+        return None
+    dtype = getattr(what, "dtype", None) if hasattr(type(what), "dtype") else None
+    return f"{kind}[shape={shape}" + (f", dtype={dtype}]" if dtype else "]")
+
+
+def make_signature(what: "Any", mode: str = "bounded") -> str:
+    if mode == "lazy":
+        return ""
+    if isinstance(what, Proxy):
+        # its repr would be a round trip to JS
+        return f"<js object {what.ffid}>"
+    if mode == "eager":
+        return repr(what)
+
+    if (summary := summarize(what)) is not None:
+        return summary
+    sig = bounded_repr(what)
+    return sig if len(sig) <= MAX_LENGTH else sig[: MAX_LENGTH - 3] + "..."
@@ -0,0 +1,73 @@
+import asyncio
+import contextlib
+import contextvars
+import traceback
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any, AsyncIterator
+
+    from .bridge import Bridge
+
+
+class Stream:
+    """
+    Pushes the items of an async iterator to JS as they're produced. JS hands credit
+    back as it consumes them, and the producer waits whenever it runs out, so a slow
+    consumer throttles the iterator rather than having its items pile up.
+
+    Items are sent as `{"c": "stream", "s": id, "item": [key, val, sig]}`, and the
+    stream ends with `"done"` or `"error"` instead of an item.
+    """
+
+    def __init__(self, bridge: "Bridge", sid: int, it: "AsyncIterator", window: int):
+        self.bridge = bridge
+        self.sid = sid
+        self.it = it
+        self.credit = window
+        self.has_credit = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def start(self):
+        # the stream outlives the request that opened it, so it shouldn't count toward
+        # what that request allocated, or be held to its deadline. (`create_task` only
+        # takes a context from 3.11)
+        self.task = contextvars.Context().run(asyncio.create_task, self._pump())
+
+    def grant(self, n: int):
+        self.credit += n
+        if self.credit > 0:
+            self.has_credit.set()
+
+    async def _pump(self):
+        try:
+            while True:
+                while self.credit <= 0:
+                    self.has_credit.clear()
+                    await self.has_credit.wait()
+                try:
+                    item = await anext(self.it)
+                except StopAsyncIteration:
+                    await self._send(done=True)
+                    return
+                self.credit -= 1
+                await self._send(item=self.bridge.describe(item))
+        except Exception:
+            await self._send(error=traceback.format_exc())
+        finally:
+            self.bridge.streams.pop(self.sid, None)
+
+    async def _send(self, **msg: "Any"):
+        await self.bridge.ipc.queue({"c": "stream", "s": self.sid, **msg})
+
+    async def close(self):
+        """Stops producing, and lets the iterator clean up after itself."""
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+        if (aclose := getattr(self.it, "aclose", None)) is not None:
+            try:
+                await aclose()
+            except Exception:
+                traceback.print_exc()
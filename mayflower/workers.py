@@ -0,0 +1,274 @@
+import asyncio
+import gc
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from multiprocessing.connection import wait
+from typing import TYPE_CHECKING
+
+from .interface import HOST, PORT, Interface
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any
+
+# a worker that dies sooner than this after starting is considered to be crashing, and
+# is restarted after a growing delay
+STABLE_AFTER = 1.0
+MAX_BACKOFF = 30.0
+
+
+def listen(host: str, port: int) -> list[socket.socket]:
+    """Binds the listening sockets for every address `host` resolves to."""
+    socks = []
+    for family, kind, proto, _, addr in socket.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE
+    ):
+        if any(s.getsockname()[:2] == addr[:2] for s in socks):
+            continue
+        sock = socket.socket(family, kind, proto)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if family == socket.AF_INET6:
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+        sock.bind(addr)
+        sock.listen(socket.SOMAXCONN)
+        sock.setblocking(False)
+        socks.append(sock)
+    return socks
+
+
+def serve_worker(socks: list[socket.socket], options: dict):
+    interface = Interface(shutdown_on_close=False, **options)
+    asyncio.run(interface.run(socks))
+
+
+def serve_fork(socks: list[socket.socket], taken: int, i: int, options: dict):
+    async def accepting() -> socket.socket:
+        conn = await accept(socks)
+        os.write(taken, i.to_bytes(4, "big"))
+        for sock in socks:
+            sock.close()
+        return conn
+
+    # the server is all set up before the connection it serves arrives
+    interface = Interface(single_connection=True, **options)
+    asyncio.run(interface.run(accepting=accepting()))
+
+
+async def accept(socks: list[socket.socket]) -> socket.socket:
+    """Waits for a single connection, on whichever socket gets one first."""
+    loop = asyncio.get_running_loop()
+    accepted = loop.create_future()
+
+    def ready(sock: socket.socket):
+        try:
+            conn, _ = sock.accept()
+        except BlockingIOError:
+            # another process took it
+            return
+        for s in socks:
+            loop.remove_reader(s)
+        accepted.set_result(conn)
+
+    for sock in socks:
+        loop.add_reader(sock, ready, sock)
+    try:
+        return await accepted
+    finally:
+        for sock in socks:
+            loop.remove_reader(sock)
+
+
+class Supervisor:
+    """
+    Runs the server in `workers` forked processes, which all accept connections from
+    the same listening sockets. A websocket is a single connection, so everything it
+    sends (and every ffid it creates) stays on the worker that accepted it.
+
+    Workers that exit are restarted, backing off while they keep crashing. The
+    supervisor runs until it's interrupted, at which point it stops every worker.
+    """
+
+    def __init__(self, workers: int, **options: "Any"):
+        if workers < 1:
+            raise ValueError("At least one worker is required")
+
+        self.workers = workers
+        self.options = options
+        # the listening sockets have to be inherited, and nothing else (ie. an event
+        # loop) is running here yet, so forking is safe
+        self.ctx = multiprocessing.get_context("fork")
+        self.procs: list[multiprocessing.Process | None] = [None] * workers
+        self.started = [0.0] * workers
+        self.backoff = [0.0] * workers
+        self.restart_at = [0.0] * workers
+        self.stopping = False
+
+    def run(self):
+        self.socks = listen(HOST, PORT)
+        # signal handlers only run between bytecodes, so they poke this pipe to wake
+        # up the wait for workers
+        self.wakeup, wakeup = os.pipe()
+        signal.signal(signal.SIGTERM, lambda *_: self.stop(wakeup))
+        signal.signal(signal.SIGINT, lambda *_: self.stop(wakeup))
+
+        print(f"Mayflower listening on ws://{HOST}:{PORT} {self.describe()}")
+        try:
+            while not self.stopping:
+                self._tick()
+        finally:
+            self._shutdown()
+            os.close(self.wakeup)
+            os.close(wakeup)
+            print("Mayflower shutting down")
+
+    def describe(self) -> str:
+        return f"with {self.workers} workers"
+
+    def stop(self, wakeup: int):
+        self.stopping = True
+        os.write(wakeup, b"\0")
+
+    def _tick(self):
+        now = time.monotonic()
+        for i, proc in enumerate(self.procs):
+            if proc is None and now >= self.restart_at[i]:
+                self._start(i)
+
+        pending = [self.restart_at[i] for i, p in enumerate(self.procs) if p is None]
+        timeout = max(0.0, min(pending) - now) if pending else None
+        sentinels = {p.sentinel: i for i, p in enumerate(self.procs) if p is not None}
+        for ready in wait([*sentinels, *self._waitables()], timeout):
+            if ready in sentinels:
+                self._reap(sentinels[ready])
+            else:
+                self._ready(ready)
+
+    def _waitables(self) -> list:
+        return [self.wakeup]
+
+    def _ready(self, ready: "Any"):
+        pass
+
+    def _children(self) -> list[multiprocessing.Process]:
+        return [p for p in self.procs if p is not None]
+
+    def _start(self, i: int):
+        options = self.options
+        if options.get("metrics_port") is not None:
+            # every worker has metrics of its own, so they can't share a port
+            options = {**options, "metrics_port": options["metrics_port"] + i}
+        proc = self.ctx.Process(
+            target=serve_worker,
+            args=(self.socks, options),
+            name=f"mayflower-worker-{i}",
+        )
+        proc.start()
+        self.procs[i] = proc
+        self.started[i] = time.monotonic()
+
+    def _reap(self, i: int):
+        proc = self.procs[i]
+        proc.join()
+        self.procs[i] = None
+        if self.stopping:
+            return
+
+        now = time.monotonic()
+        if now - self.started[i] < STABLE_AFTER:
+            self.backoff[i] = min(max(self.backoff[i] * 2, 0.5), MAX_BACKOFF)
+        else:
+            self.backoff[i] = 0.0
+        self.restart_at[i] = now + self.backoff[i]
+        print(
+            f"Mayflower worker {proc.pid} exited with code {proc.exitcode}, "
+            f"restarting in {self.backoff[i]:.1f}s"
+        )
+
+    def _shutdown(self):
+        procs = self._children()
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join(5)
+            if proc.is_alive():
+                proc.kill()
+                proc.join()
+        for sock in self.socks:
+            sock.close()
+
+
+class Template(Supervisor):
+    """
+    Serves every connection from a fork of this process, which starts out with
+    whatever was imported and set up before it (ie. `--preload`ed modules) and is
+    thrown away, along with everything the connection did, once it closes. A new
+    connection gets a clean Python in the time a fork takes, rather than the seconds
+    a new interpreter spends importing everything again.
+
+    `spares` forks are kept waiting, each for a single connection. The ones that take
+    one are replaced straight away.
+    """
+
+    def __init__(self, spares: int = 1, **options: "Any"):
+        # forks come and go too quickly to be scraped
+        options = {**options, "metrics_port": None}
+        super().__init__(spares, **options)
+        self.busy: dict[int, multiprocessing.Process] = {}
+
+    def run(self):
+        self.taken, self.taken_w = os.pipe()
+        # nothing from before the fork is collected by it then, so the collector
+        # doesn't copy every page it's on
+        gc.freeze()
+        try:
+            super().run()
+        finally:
+            os.close(self.taken)
+            os.close(self.taken_w)
+
+    def describe(self) -> str:
+        return "forking a fresh server per connection"
+
+    def _start(self, i: int):
+        proc = self.ctx.Process(
+            target=serve_fork,
+            args=(self.socks, self.taken_w, i, self.options),
+            name=f"mayflower-fork-{i}",
+        )
+        proc.start()
+        self.procs[i] = proc
+        self.started[i] = time.monotonic()
+
+    def _waitables(self) -> list:
+        return [*super()._waitables(), self.taken, *self.busy]
+
+    def _ready(self, ready: "Any"):
+        if ready == self.taken:
+            self._drain()
+        elif (proc := self.busy.pop(ready, None)) is not None:
+            proc.join()
+
+    def _drain(self):
+        if not wait([self.taken], 0):
+            return
+        # each fork writes its index once, which the pipe never splits
+        data = os.read(self.taken, 4096)
+        now = time.monotonic()
+        for offset in range(0, len(data), 4):
+            i = int.from_bytes(data[offset : offset + 4], "big")
+            proc = self.procs[i]
+            self.busy[proc.sentinel] = proc
+            self.procs[i] = None
+            self.backoff[i] = 0.0
+            self.restart_at[i] = now
+
+    def _reap(self, i: int):
+        # a fork that served a quick connection may exit before it's known as busy
+        self._drain()
+        if self.procs[i] is not None:
+            super()._reap(i)
+
+    def _children(self) -> list[multiprocessing.Process]:
+        return [*super()._children(), *self.busy.values()]